@@ -1,62 +1,255 @@
+import threading
+import time
 import rospy
+from mavros_msgs.msg import State
 from mavros_msgs.srv import *
 
-# FCU mode selection
+# mavros services used for arming and mode selection
+SERVICES = {
+    'arming': ('/mavros/cmd/arming', CommandBool),
+    'set_mode': ('/mavros/set_mode', SetMode)}
+
+###################################
+#
+# class modeRequest
+#   Handle of an arm or mode request running in the background
+#
+# Syntax:
+#   ok = req.wait(timeout)      # block until finished, True if confirmed
+#
+# Fields:
+#   kind = 'arming' or 'set_mode'
+#   value = True/False for arming, custom mode string for set_mode
+#   shared = Boolean if the calls go through the shared persistent proxy
+#            (False for land requests, see modeManager)
+#   done = Boolean if finished (successfully or not)
+#   success = Boolean if the FCU confirmed the transition on /mavros/state
+#   attempts = number of service calls made
+#   error = reason of the last failure
+#
+#####
+
+class modeRequest:
+    def __init__(self,kind,value,callback=None,shared=True):
+        self.kind = kind
+        self.value = value
+        self.shared = shared
+        self.callback = callback
+        self.done = False
+        self.success = False
+        self.attempts = 0
+        self.error = ''
+        self.event = threading.Event()
+
+    def wait(self,timeout=None):
+        self.event.wait(timeout)
+        return self.success
+
+    def finish(self,success,error=''):
+        self.success = success
+        self.error = error
+        self.done = True
+        self.event.set()
+        if self.callback is not None:
+            self.callback(self)
+
+###################################
+#
+# class modeManager
+#   Persistent connections to the mavros arming and set_mode services with
+#   non-blocking requests that are retried and confirmed against /mavros/state
+#
+# Syntax:
+#   modes = modeManager(timeout,retries)
+#   modes.connect()                             # once, before flight
+#   req = modes.setModeAsync('OFFBOARD',callback)
+#   req = modes.armAsync(True,callback)
+#   req = modes.land()                          # AUTO.LAND, non-blocking
+#   ok = modes.setMode('POSCTL')                # blocking
+#
+#   callback(req) is called from the request thread when req finishes
+#   timeout = time to wait for confirmation of each attempt (s)
+#   retries = additional attempts after a failed or unconfirmed one
+#
+#   Requests of one kind share a persistent proxy and are called one at a
+#   time. A service call has no timeout, so land() opens a connection of
+#   its own for each call instead: it never queues behind a hung call.
+#   The blocking arm and setMode give up after timeout*(retries+1) and
+#   return False if the request is still running.
+#
+# Subscriptions:
+#   rospy.Subscriber('/mavros/state', State, self.cbFCUstate)
+#
+# Fields:
+#   armed, mode, connected = latest FCU state
+#
+#####
+
+class modeManager:
+    def __init__(self,timeout=2.0,retries=2):
+        self.timeout = timeout
+        self.retries = retries
+
+        self.armed = False
+        self.mode = ''
+        self.connected = False
+        self.stateCond = threading.Condition()
+
+        self.proxies = {}
+        self.proxyLock = threading.Lock()
+        self.callLocks = dict((kind,threading.Lock()) for kind in SERVICES)
+
+        rospy.Subscriber('/mavros/state', State, self.cbFCUstate)
+
+    def cbFCUstate(self,msg):
+        if not msg == None:
+            with self.stateCond:
+                self.armed = msg.armed
+                self.mode = msg.mode
+                self.connected = msg.connected
+                self.stateCond.notify_all()
+
+    def connect(self,timeout=None):
+        for kind in SERVICES:
+            self.proxy(kind,timeout)
+
+    def proxy(self,kind,timeout=None):
+        with self.proxyLock:
+            service = self.proxies.get(kind)
+            if service is None:
+                (name,srvType) = SERVICES[kind]
+                rospy.wait_for_service(name,timeout)
+                service = rospy.ServiceProxy(name,srvType,persistent=True)
+                self.proxies[kind] = service
+        return service
+
+    def drop(self,kind):
+        # forget a broken persistent connection so the next call reconnects
+        with self.proxyLock:
+            service = self.proxies.pop(kind,None)
+        if service is not None:
+            service.close()
+
+    def call(self,kind,value,shared=True):
+        if not shared:                  # own connection, no lock to wait for
+            (name,srvType) = SERVICES[kind]
+            return self.invoke(rospy.ServiceProxy(name,srvType),kind,value)
+        service = self.proxy(kind,self.timeout)
+        with self.callLocks[kind]:
+            return self.invoke(service,kind,value)
+
+    def invoke(self,service,kind,value):
+        if kind == 'arming':
+            return service(value).success
+        return service(custom_mode=value).mode_sent
+
+    def confirmed(self,kind,value):
+        if kind == 'arming':
+            return self.armed == value
+        return self.mode == value
+
+    def execute(self,req,timeout,retries):
+        error = ''
+        for _ in range(retries + 1):
+            if rospy.is_shutdown():
+                break
+            req.attempts = req.attempts + 1
+            try:
+                accepted = self.call(req.kind,req.value,req.shared)
+            except (rospy.ServiceException,rospy.ROSException) as e:
+                if req.shared:
+                    self.drop(req.kind)
+                error = 'service %s call failed: %s' % (req.kind,e)
+                continue
+
+            if not accepted:
+                error = 'FCU rejected %s %s' % (req.kind,req.value)
+                continue
+
+            deadline = time.time() + timeout
+            with self.stateCond:
+                while not self.confirmed(req.kind,req.value):
+                    remaining = deadline - time.time()
+                    if remaining <= 0.0:
+                        break
+                    self.stateCond.wait(remaining)
+                ok = self.confirmed(req.kind,req.value)
+            if ok:
+                req.finish(True)
+                return
+            error = '%s %s not confirmed on /mavros/state' % (req.kind,req.value)
+
+        rospy.logerr('%s. Could not set %s %s.' % (error,req.kind,req.value))
+        req.finish(False,error)
+
+    def request(self,kind,value,callback=None,timeout=None,retries=None,shared=True):
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        req = modeRequest(kind,value,callback,shared)
+        worker = threading.Thread(target=self.execute,args=(req,timeout,retries))
+        worker.daemon = True
+        worker.start()
+        return req
+
+    def armAsync(self,value=True,callback=None,timeout=None,retries=None):
+        return self.request('arming',value,callback,timeout,retries)
+
+    def setModeAsync(self,mode,callback=None,timeout=None,retries=None):
+        return self.request('set_mode',mode,callback,timeout,retries)
+
+    def land(self,callback=None):
+        return self.request('set_mode','AUTO.LAND',callback,shared=False)
+
+    def limit(self,timeout,retries):
+        # longest wait of a blocking request
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        return timeout*(retries + 1)
+
+    def arm(self,value=True,timeout=None,retries=None):
+        req = self.armAsync(value,None,timeout,retries)
+        return req.wait(self.limit(timeout,retries))
+
+    def setMode(self,mode,timeout=None,retries=None):
+        req = self.setModeAsync(mode,None,timeout,retries)
+        return req.wait(self.limit(timeout,retries))
+
+###################################
+#
+# FCU mode selection (blocking, shared modeManager)
+#
+#####
+
+manager = None
+
+def getManager():
+    global manager
+    if manager is None:
+        manager = modeManager()
+    return manager
 
 def setArm():
-    rospy.wait_for_service('/mavros/cmd/arming')
-    try:
-        armService = rospy.ServiceProxy('/mavros/cmd/arming', mavros_msgs.srv.CommandBool)
-        armService(True)
-    except rospy.ServiceException, e:
-        print "Service arming call failed: %s"%e
+    return getManager().arm(True)
 
 def setDisarm():
-    rospy.wait_for_service('/mavros/cmd/arming')
-    try:
-        armService = rospy.ServiceProxy('/mavros/cmd/arming', mavros_msgs.srv.CommandBool)
-        armService(False)
-    except rospy.ServiceException, e:
-        print "Service disarming call failed: %s"%e
+    return getManager().arm(False)
 
 def setStabilizedMode():
-    rospy.wait_for_service('/mavros/set_mode')
-    try:
-        flightModeService = rospy.ServiceProxy('/mavros/set_mode', mavros_msgs.srv.SetMode)
-        flightModeService(custom_mode='STABILIZED')
-    except rospy.ServiceException, e:
-        print "service set_mode call failed: %s. Stabilized Mode could not be set."%e
+    return getManager().setMode('STABILIZED')
 
 def setOffboardMode():
-    rospy.wait_for_service('/mavros/set_mode')
-    try:
-        flightModeService = rospy.ServiceProxy('/mavros/set_mode', mavros_msgs.srv.SetMode)
-        flightModeService(custom_mode='OFFBOARD')
-    except rospy.ServiceException, e:
-        print "service set_mode call failed: %s. Offboard Mode could not be set."%e
+    return getManager().setMode('OFFBOARD')
 
 def setAltitudeMode():
-    rospy.wait_for_service('/mavros/set_mode')
-    try:
-        flightModeService = rospy.ServiceProxy('/mavros/set_mode', mavros_msgs.srv.SetMode)
-        flightModeService(custom_mode='ALTCTL')
-    except rospy.ServiceException, e:
-        print "service set_mode call failed: %s. Altitude Mode could not be set."%e
+    return getManager().setMode('ALTCTL')
 
 def setPositionMode():
-    rospy.wait_for_service('/mavros/set_mode')
-    try:
-        flightModeService = rospy.ServiceProxy('/mavros/set_mode', mavros_msgs.srv.SetMode)
-        flightModeService(custom_mode='POSCTL')
-    except rospy.ServiceException, e:
-        print "service set_mode call failed: %s. Position Mode could not be set."%e
+    return getManager().setMode('POSCTL')
 
 def setAutoLandMode():
-    rospy.wait_for_service('/mavros/set_mode')
-    try:
-        flightModeService = rospy.ServiceProxy('/mavros/set_mode', mavros_msgs.srv.SetMode)
-        flightModeService(custom_mode='AUTO.LAND')
-    except rospy.ServiceException, e:
-        print "service set_mode call failed: %s. Autoland Mode could not be set."%e
-
-
+    modes = getManager()
+    return modes.land().wait(modes.limit(None,None))
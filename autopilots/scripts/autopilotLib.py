@@ -9,21 +9,211 @@ from sensor_msgs.msg import *
 from geometry_msgs.msg import *
 from mavros_msgs.msg import *
 from mavros_msgs.srv import *
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
 
 
+###################################
+#
+# class vehicleState
+#   Single shared copy of the vehicle pose and FCU state for all controllers
+#
+# Syntax:
+#   state = vehicleState(histSize)
+#   state.subscribe()
+#   state.update()          # take one consistent sample per control step
+#   pose = state.history.at(t)  # pose at an earlier time t (see poseHistory)
+#
+# Subscriptions:
+#   rospy.Subscriber('/mavros/local_position/pose', PoseStamped, self.cbPos)
+#   rospy.Subscriber('/mavros/state', State, self.cbFCUstate)
+#
+# Fields (sample taken by the last update()):
+#   x, y, z = position of body frame origin in local ENU coordinates (m)
+#   yaw = yaw angle of relative (yaw,pitch,roll) in Local ENU -> Body NED,
+#         computed from the quaternion on first access after update()
+#         (the history keeps the quaternion and does the same)
+#   engaged = Boolean if armed and offboard
+#   stamp = time stamp of the sampled pose message (s)
+#   history = poseHistory of the poses sampled by update()
+#
+#####
+
+class vehicleState(object):
+    def __init__(self,histSize=64):
+
+        self.poseMsg = None                 # latest messages from callbacks
+        self.stateMsg = None
+
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.q = (0.0,0.0,0.0,1.0)
+        self.engaged = False
+        self.stamp = 0.0
+        self._yaw = 0.0
+        self._yawValid = True
+        self.history = poseHistory(histSize)
+
+    def subscribe(self):
+        rospy.Subscriber('/mavros/local_position/pose', PoseStamped, self.cbPos)
+        rospy.Subscriber('/mavros/state', State, self.cbFCUstate)
+
+    def cbPos(self,msg):
+        if not msg == None:
+            self.poseMsg = msg
+
+    def cbFCUstate(self,msg):
+        if not msg == None:
+            self.stateMsg = msg
+
+    def update(self):
+        msg = self.poseMsg
+        if not msg == None:
+            self.x = msg.pose.position.x
+            self.y = msg.pose.position.y
+            self.z = msg.pose.position.z
+            self.q = (
+                msg.pose.orientation.x,
+                msg.pose.orientation.y,
+                msg.pose.orientation.z,
+                msg.pose.orientation.w)
+            stamp = msg.header.stamp.to_sec()
+            self._yawValid = False
+            if stamp > self.stamp:                  # new pose message
+                self.stamp = stamp
+                self.history.record(stamp,self.x,self.y,self.z,None,self.q)
+
+        msg = self.stateMsg
+        if not msg == None:
+            self.engaged = msg.armed and (msg.mode == 'OFFBOARD')
+
+    @property
+    def yaw(self):
+        if not self._yawValid:
+            self._yaw = quaternionYaw(self.q)
+            self._yawValid = True
+        return self._yaw
+
+###################################
+#
+# function quaternionYaw
+#   Yaw of a (x,y,z,w) quaternion, as vehicleState.yaw
+#
+#####
+
+def quaternionYaw(q):
+    euler = tf.transformations.euler_from_quaternion(q, 'rzyx') #yaw/pitch/roll
+    return euler[0]
+
+###################################
+#
+# class poseHistory
+#   Short history of vehicle poses for aligning delayed measurements (e.g.
+#   camera detections) with the pose at their capture time
+#
+# Syntax:
+#   history = poseHistory(size)
+#   history.record(t,x,y,z,yaw)         # in increasing time order
+#   history.record(t,x,y,z,None,q)      # yaw from quaternion q, on first query
+#   pose = history.at(t)                # None if nothing recorded
+#
+#   pose = poseSample interpolated at t, clamped to the oldest/newest pose
+#
+#####
+
+class poseSample:
+    def __init__(self,stamp=0.0,x=0.0,y=0.0,z=0.0,yaw=0.0):
+        self.stamp = stamp
+        self.x = x
+        self.y = y
+        self.z = z
+        self.yaw = yaw
+
+class poseHistory:
+    def __init__(self,size=64):
+        self.size = size
+        self.buf = np.zeros((size,5))               # t, x, y, z, yaw
+        self.quat = np.zeros((size,4))              # orientation while yaw is NaN
+        self.count = 0
+
+    def record(self,t,x,y,z,yaw,q=None):
+        if self.count > 0 and t <= self.buf[(self.count - 1) % self.size,0]:
+            return
+        k = self.count % self.size
+        if yaw is None:
+            yaw = np.nan
+            self.quat[k] = q
+        self.buf[k] = (t,x,y,z,yaw)
+        self.count = self.count + 1
+
+    def time(self,k):
+        return self.buf[k % self.size,0]
+
+    def row(self,k):
+        row = self.buf[k % self.size]
+        if isnan(row[4]):                           # yaw of a recorded quaternion, once
+            row[4] = quaternionYaw(self.quat[k % self.size])
+        return row
+
+    def at(self,t):
+        if self.count == 0:
+            return None
+        lo = max(self.count - self.size,0)
+        hi = self.count - 1
+        if t <= self.time(lo):
+            return poseSample(*self.row(lo))
+        if t >= self.time(hi):
+            return poseSample(*self.row(hi))
+
+        while hi - lo > 1:                          # bisect the ring in time order
+            mid = (lo + hi)//2
+            if self.time(mid) <= t:
+                lo = mid
+            else:
+                hi = mid
+
+        a = self.row(lo)
+        b = self.row(hi)
+        f = (t - a[0])/(b[0] - a[0])
+        dYaw = atan2(sin(b[4] - a[4]),cos(b[4] - a[4]))
+        return poseSample(t,a[1] + f*(b[1] - a[1]),a[2] + f*(b[2] - a[2]),
+            a[3] + f*(b[3] - a[3]),a[4] + f*dYaw)
+
+
+###################################
+#
+# loadParams (kAltVel, kBodVel, targetTracker)
+#   The controllers cache their ROS parameters and read them again only in
+#   loadParams, at construction and on /autopilot/reloadParams. Each
+#   parameter namespace is fetched with a single get_param of the namespace
+#   (a dict of its parameters): one round trip to the parameter server per
+#   namespace instead of one per parameter.
+#
+#####
+
 ###################################
 #
 # class kAltVel
 #   Altitude controller based on outer loop velocity commands to FCU
 #
 # Return:
+#   vzRef = controller(dt)
 #   vzRef = reference velocity to FCU (m/s, positive upward)
+#   dt = measured step (s) for the integrator, None for 1/fbRate
+#
+# Syntax:
+#   altK = kAltVel(state,getParam)
+#
+#   state = shared vehicleState; if None, z and engaged come from the
+#           cbPos/cbFCUstate callbacks (one subscription per controller)
+#   getParam = parameter lookup, rospy.get_param if None
 #
 # Subscriptions:
 #   rospy.Subscriber('/mavros/local_position/pose', PoseStamped, self.cbPos)
 #   rospy.Subscriber('/mavros/state', State, self.cbFCUstate)
+#   rospy.Subscriber('/autopilot/reloadParams', Empty, self.cbReload)
 #   
-# ROS parameters:
+# ROS parameters (read at construction and on cbReload/loadParams only):
 #   /main/fbRate = feedback sampling rate (Hz)
 #   /kAltVel/gP = proportional gain
 #   /kAltVel/gI = integral gain
@@ -32,6 +222,7 @@ from mavros_msgs.srv import *
 #
 # Fields:
 #   callback functions
+#   fbRate, gP, gI, vMaxU, vMaxD = cached ROS parameters
 #   ezInt = integrated altitude error
 #   zSp = commanded altitude setpoint (m)
 #   z = current altitude from /mavros/local_position/pose (m)
@@ -40,12 +231,26 @@ from mavros_msgs.srv import *
 #####
 
 class kAltVel:
-    def __init__(self):
+    def __init__(self,state=None,getParam=None):
 
+        self.state = state
+        self.getParam = getParam or rospy.get_param
         self.ezInt = 0.0
         self.zSp = 0.0
         self.z = 0.0
         self.engaged = False
+        self.loadParams()
+
+    def loadParams(self):
+        gains = self.getParam('/kAltVel')
+        self.fbRate = self.getParam('/main/fbRate')
+        self.gP = gains['gP']
+        self.gI = gains['gI']
+        self.vMaxU = gains['vMaxU']
+        self.vMaxD = gains['vMaxD']
+
+    def cbReload(self,msg):
+        self.loadParams()
 
     def cbPos(self,msg):
         if not msg == None:
@@ -58,13 +263,20 @@ class kAltVel:
             else:
                 self.engaged = False
 
-    def controller(self):
+    def controller(self,dt=None):
     
-        fbRate = rospy.get_param('/main/fbRate')
-        gP = rospy.get_param('/kAltVel/gP')
-        gI = rospy.get_param('/kAltVel/gI')
-        vMaxU = rospy.get_param('/kAltVel/vMaxU')
-        vMaxD = rospy.get_param('/kAltVel/vMaxD')
+        fbRate = self.fbRate
+        gP = self.gP
+        gI = self.gI
+        vMaxU = self.vMaxU
+        vMaxD = self.vMaxD
+
+        if self.state is not None:                          # shared state sample
+            self.z = self.state.z
+            self.engaged = self.state.engaged
+
+        if dt is None:
+            dt = 1.0/fbRate
 
         ez = self.zSp - self.z                              # altitude erro
 
@@ -74,7 +286,7 @@ class kAltVel:
             vzRef = myLib.sat(vzRef,-vMaxD,vMaxU)
         else:
             if self.engaged:                                # if armed & offboard
-                self.ezInt = self.ezInt + ez/fbRate         # integrate
+                self.ezInt = self.ezInt + ez*dt             # integrate
 
         return vzRef
 
@@ -84,13 +296,23 @@ class kAltVel:
 #   Body velocity controller based on outer loop velocity commands to FCU
 #
 # Return:
+#   vxCom,vyCom,yawRateCom = controller(dt)
 #   vxCom,vyCom,yawRateCom = reference commands to FCU (m/s, local ENU coordinates)
+#   dt = measured step (s) for the integrators, None for 1/fbRate
+#
+# Syntax:
+#   bodK = kBodVel(state,getParam)
+#
+#   state = shared vehicleState; if None, x, y, yaw and engaged come from
+#           the cbPos/cbFCUstate callbacks (one subscription per controller)
+#   getParam = parameter lookup, rospy.get_param if None
 #
 # Subscriptions:
 #   rospy.Subscriber('/mavros/local_position/pose', PoseStamped, self.cbPos)
 #   rospy.Subscriber('/mavros/state', State, self.cbFCUstate)
+#   rospy.Subscriber('/autopilot/reloadParams', Empty, self.cbReload)
 #   
-# ROS parameters:
+# ROS parameters (read at construction and on cbReload/loadParams only):
 #   /main.fbRate = feedback sampling rate (Hz)
 #   /kBodVel/gP = proportional gain for velocity control
 #   /kBodVel/gI = integral gain for velocity control
@@ -102,6 +324,7 @@ class kAltVel:
 #
 # Fields:
 #   callback functions
+#   fbRate, gP, gI, vMax, gPyaw, yawOff, yawCone, yawTurnRate = cached ROS parameters
 #   exInt = integrated error
 #   eyInt = integrated error
 #   xSp = commanded x setpoint (NED-h, m) NOTE: NED-h = NED projected to horizontal
@@ -114,8 +337,10 @@ class kAltVel:
 #####
 
 class kBodVel:
-    def __init__(self):
+    def __init__(self,state=None,getParam=None):
 
+        self.state = state
+        self.getParam = getParam or rospy.get_param
         self.exInt = 0.0
         self.eyInt = 0.0
         self.xSp = 0.0
@@ -124,6 +349,21 @@ class kBodVel:
         self.y = 0.0
         self.yaw = 0.0
         self.engaged = False
+        self.loadParams()
+
+    def loadParams(self):
+        gains = self.getParam('/kBodVel')
+        self.fbRate = self.getParam('/main/fbRate')
+        self.gP = gains['gP']
+        self.gI = gains['gI']
+        self.vMax = gains['vMax']
+        self.gPyaw = gains['gPyaw']
+        self.yawOff = gains['yawOff']
+        self.yawCone = gains['yawCone']
+        self.yawTurnRate = gains['yawTurnRate']
+
+    def cbReload(self,msg):
+        self.loadParams()
 
     def cbPos(self,msg):
         if not msg == None:
@@ -144,16 +384,25 @@ class kBodVel:
             else:
                 self.engaged = False
 
-    def controller(self):
+    def controller(self,dt=None):
     
-        fbRate = rospy.get_param('/main/fbRate')
-        gP = rospy.get_param('/kBodVel/gP')
-        gI = rospy.get_param('/kBodVel/gI')
-        vMax = rospy.get_param('/kBodVel/vMax')
-        gPyaw = rospy.get_param('/kBodVel/gPyaw')
-        yawOff = rospy.get_param('/kBodVel/yawOff')
-        yawCone = rospy.get_param('/kBodVel/yawCone')
-        yawTurnRate = rospy.get_param('/kBodVel/yawTurnRate')
+        fbRate = self.fbRate
+        gP = self.gP
+        gI = self.gI
+        vMax = self.vMax
+        gPyaw = self.gPyaw
+        yawOff = self.yawOff
+        yawCone = self.yawCone
+        yawTurnRate = self.yawTurnRate
+
+        if self.state is not None:                  # shared state sample
+            self.x = self.state.x
+            self.y = self.state.y
+            self.yaw = self.state.yaw
+            self.engaged = self.state.engaged
+
+        if dt is None:
+            dt = 1.0/fbRate
 
         ######
         # longitudinal/lateral control
@@ -172,8 +421,8 @@ class kBodVel:
             vyRef = vyRef*scale
         else:
             if self.engaged:                            # if armed & offboard
-                self.exInt = self.exInt + ex/fbRate     # integrate
-                self.eyInt = self.eyInt + ey/fbRate
+                self.exInt = self.exInt + ex*dt         # integrate
+                self.eyInt = self.eyInt + ey*dt
 
         ######
         # Convert body commands to local ENU coordinates
@@ -202,6 +451,119 @@ class kBodVel:
 
         return vxCom, vyCom, yawRateCom
 
+###################################
+#
+# class controlLoop
+#   Fixed-rate control scheduler with jitter instrumentation. wait() sleeps
+#   to the next deadline so that sampling, computing and publishing follow
+#   it immediately; done() marks the end of the cycle's work.
+#
+# Syntax:
+#   loop = controlLoop(fbRate)
+#   while loop.wait():
+#       state.update()
+#       ... controllers with loop.dt ...
+#       command.publish(setp)
+#       loop.done()
+#
+# Publications:
+#   /autopilot/loopDiag (DiagnosticArray) every diagPeriod seconds
+#
+# Fields:
+#   period = nominal cycle period 1/fbRate (s)
+#   dt = measured time between cycle starts, clamped to [dtMin,dtMax]*period (s)
+#   cycleTime = time between wait() returning and done() (s)
+#   cycleMax = worst cycleTime since start (s)
+#   cycles = number of cycles run
+#   overruns = cycles that started after their deadline plus one period
+#   jitterEdges = lateness bin edges (s)
+#   jitterHist = counts of cycle start lateness per bin (last bin open ended)
+#
+#####
+
+class controlLoop:
+    def __init__(self,fbRate,diagPeriod=1.0,dtMin=0.5,dtMax=2.0):
+        self.period = 1.0/fbRate
+        self.diagPeriod = diagPeriod
+        self.dtMin = dtMin
+        self.dtMax = dtMax
+
+        self.dt = self.period
+        self.cycleTime = 0.0
+        self.cycleMax = 0.0
+        self.cycles = 0
+        self.overruns = 0
+        self.jitterEdges = [0.0,0.001,0.002,0.005,0.01,0.02,0.05]
+        self.jitterHist = [0]*len(self.jitterEdges)
+
+        self.deadline = None
+        self.tStart = None
+        self.tDiag = 0.0
+        self.diag = rospy.Publisher('/autopilot/loopDiag', DiagnosticArray, queue_size=1)
+
+    def wait(self):
+        now = rospy.get_time()
+        if self.deadline is None:
+            self.deadline = now
+        elif now < self.deadline:
+            rospy.sleep(self.deadline - now)
+            now = rospy.get_time()
+
+        if rospy.is_shutdown():
+            return False
+
+        late = now - self.deadline
+        k = 0
+        while k + 1 < len(self.jitterEdges) and late >= self.jitterEdges[k + 1]:
+            k = k + 1
+        self.jitterHist[k] = self.jitterHist[k] + 1
+
+        if late > self.period:                          # missed a whole cycle
+            self.overruns = self.overruns + 1
+            self.deadline = now                         # resync, do not burst
+
+        if self.tStart is not None:
+            self.dt = myLib.sat(now - self.tStart,self.dtMin*self.period,self.dtMax*self.period)
+        self.tStart = now
+        self.deadline = self.deadline + self.period
+        self.cycles = self.cycles + 1
+        return True
+
+    def done(self):
+        now = rospy.get_time()
+        self.cycleTime = now - self.tStart
+        self.cycleMax = max(self.cycleMax,self.cycleTime)
+        if now - self.tDiag >= self.diagPeriod:
+            self.tDiag = now
+            self.publishDiag()
+
+    def publishDiag(self):
+        status = DiagnosticStatus()
+        status.name = 'autopilot control loop'
+        status.hardware_id = 'autopilot'
+        if self.cycleMax > self.period:
+            status.level = DiagnosticStatus.WARN
+            status.message = 'cycle overran period'
+        else:
+            status.level = DiagnosticStatus.OK
+            status.message = 'ok'
+
+        values = [
+            ('period', self.period),
+            ('dt', self.dt),
+            ('cycleTime', self.cycleTime),
+            ('cycleMax', self.cycleMax),
+            ('cycles', self.cycles),
+            ('overruns', self.overruns)]
+        for k in range(len(self.jitterEdges)):
+            values.append(('jitter >= %.0f ms' % (1000.0*self.jitterEdges[k]), self.jitterHist[k]))
+        status.values = [KeyValue(key, str(value)) for (key, value) in values]
+
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        msg.status = [status]
+        self.diag.publish(msg)
+
 
 ###################################
 #
@@ -228,6 +590,175 @@ def wayHome(pos,home):
     
     return vec2home_x, vec2home_y
 
+###################################
+#
+# function bodyToLocal
+#   Inverse of wayHome: local ENU position of a point given in body NED-h
+#   coordinates
+#
+# Syntax:
+#   x, y = bodyToLocal(pos,xB,yB)
+#
+#   pos.x, pos.y, pos.yaw = origin & y-axis heading of NED body in local ENU coordinates
+#   xB, yB = point in body NED-h coordinates (m)
+#
+#####
+
+def bodyToLocal(pos,xB,yB):
+    bodyRot = pos.yaw - pi/2.0
+
+    dy = xB*cos(bodyRot) + yB*sin(bodyRot)
+    dx = -xB*sin(bodyRot) + yB*cos(bodyRot)
+
+    return pos.x + dx, pos.y + dy
+
+
+###################################
+#
+# Batch (vectorized) controllers for gain sweeps
+#
+#   Same control laws as kAltVel, kBodVel and wayHome, evaluated for many
+#   vehicles/gain sets at once. States, setpoints and gains are NumPy
+#   arrays of one common length n (gains may also be scalars).
+#
+###################################
+#
+# class kAltVelBatch
+#
+# Syntax:
+#   altK = kAltVelBatch(n,gains,fbRate,state)
+#   vzRef = altK.controller(dt)
+#
+#   gains = dict with gP, gI, vMaxU, vMaxD (scalars or length-n arrays)
+#   state = object with array field z (e.g. simVehicle), or None to set
+#           altK.z directly
+#
+# Fields:
+#   ezInt, zSp, z, engaged = length-n arrays, as in kAltVel
+#
+#####
+
+class kAltVelBatch:
+    def __init__(self,n,gains,fbRate,state=None):
+        self.gP = gains['gP']
+        self.gI = gains['gI']
+        self.vMaxU = gains['vMaxU']
+        self.vMaxD = gains['vMaxD']
+        self.fbRate = fbRate
+        self.state = state
+
+        self.ezInt = np.zeros(n)
+        self.zSp = np.zeros(n)
+        self.z = np.zeros(n)
+        self.engaged = np.ones(n,dtype=bool)
+
+    def controller(self,dt=None):
+        if dt is None:
+            dt = 1.0/self.fbRate
+        if self.state is not None:
+            self.z = self.state.z
+
+        ez = self.zSp - self.z
+        vzRef = self.gP*ez + self.gI*self.ezInt
+
+        windup = (vzRef > self.vMaxU) | (vzRef < -self.vMaxD)   # anti-windup
+        vzRef = np.clip(vzRef,-self.vMaxD,self.vMaxU)
+        self.ezInt = np.where(~windup & self.engaged,self.ezInt + ez*dt,self.ezInt)
+
+        return vzRef
+
+###################################
+#
+# class kBodVelBatch
+#
+# Syntax:
+#   bodK = kBodVelBatch(n,gains,fbRate,state)
+#   (vxCom,vyCom,yawRateCom) = bodK.controller(dt)
+#
+#   gains = dict with gP, gI, vMax, gPyaw, yawOff, yawCone, yawTurnRate
+#   state = object with array fields x, y, yaw, or None to set them directly
+#
+# Fields:
+#   exInt, eyInt, xSp, ySp, x, y, yaw, engaged = length-n arrays, as in kBodVel
+#
+#####
+
+class kBodVelBatch:
+    def __init__(self,n,gains,fbRate,state=None):
+        self.gP = gains['gP']
+        self.gI = gains['gI']
+        self.vMax = gains['vMax']
+        self.gPyaw = gains['gPyaw']
+        self.yawOff = gains['yawOff']
+        self.yawCone = np.radians(gains['yawCone'])
+        self.yawTurnRate = np.radians(gains['yawTurnRate'])
+        self.fbRate = fbRate
+        self.state = state
+
+        self.exInt = np.zeros(n)
+        self.eyInt = np.zeros(n)
+        self.xSp = np.zeros(n)
+        self.ySp = np.zeros(n)
+        self.x = np.zeros(n)
+        self.y = np.zeros(n)
+        self.yaw = np.zeros(n)
+        self.engaged = np.ones(n,dtype=bool)
+
+    def controller(self,dt=None):
+        if dt is None:
+            dt = 1.0/self.fbRate
+        if self.state is not None:
+            self.x = self.state.x
+            self.y = self.state.y
+            self.yaw = self.state.yaw
+
+        # longitudinal/lateral control
+        ex = self.xSp
+        ey = self.ySp
+        vxRef = self.gP*ex + self.gI*self.exInt
+        vyRef = self.gP*ey + self.gI*self.eyInt
+
+        vel = np.hypot(vxRef,vyRef)
+        windup = vel > self.vMax                                # anti-windup
+        scale = np.where(windup,self.vMax/np.maximum(vel,1e-12),1.0)
+        vxRef = vxRef*scale
+        vyRef = vyRef*scale
+        integrate = ~windup & self.engaged
+        self.exInt = np.where(integrate,self.exInt + ex*dt,self.exInt)
+        self.eyInt = np.where(integrate,self.eyInt + ey*dt,self.eyInt)
+
+        # Convert body commands to local ENU coordinates
+        bodyRot = self.yaw - pi/2.0
+        vxCom = vyRef*np.cos(bodyRot) - vxRef*np.sin(bodyRot)
+        vyCom = vyRef*np.sin(bodyRot) + vxRef*np.cos(bodyRot)
+
+        # Yaw control
+        dYawSp = -np.arctan2(vyRef,vxRef)
+        radius = np.hypot(ex,ey)
+        yaw_r = np.where(np.abs(dYawSp) > self.yawCone,
+            np.copysign(self.yawTurnRate,dYawSp),self.gPyaw*dYawSp)
+        yawRateCom = np.where(radius < self.yawOff,0.0,yaw_r)
+
+        return vxCom, vyCom, yawRateCom
+
+###################################
+#
+# function wayHomeBatch
+#   wayHome for arrays of positions and/or homes
+#
+#####
+
+def wayHomeBatch(pos,home):
+    dx = -(pos.x - home.x)
+    dy = -(pos.y - home.y)
+
+    bodyRot = pos.yaw - pi/2.0
+
+    vec2home_x = dy*np.cos(bodyRot) - dx*np.sin(bodyRot)
+    vec2home_y = dy*np.sin(bodyRot) + dx*np.cos(bodyRot)
+
+    return vec2home_x, vec2home_y
+
 
 ###################################
 #
@@ -259,3 +790,206 @@ class spTracker:
 
 
  
+
+###################################
+#
+# class targetTracker
+#   Constant velocity Kalman filter of the landing pad position in local ENU
+#   coordinates. Detections (body NED-h setpoints scaled to altCal, as
+#   published on target_xySp) are projected to local ENU with the vehicle
+#   pose, gated against the prediction and fused; between detections the
+#   pad position is predicted, so the controller gets a setpoint every cycle.
+#
+#   Stamped detections (target_xySpStamped, header stamp = image capture
+#   time) are projected with the pose at capture time from a poseHistory
+#   and fused at that time; the estimate is then predicted forward to the
+#   control cycle, which removes the vision pipeline delay from the setpoint.
+#   Detections older than the last fused one are dropped.
+#
+# Syntax:
+#   target = targetTracker(getParam)
+#   rospy.Subscriber('target_xySpStamped', PointStamped, target.cbTrackerStamped)
+#   target.step(state,zGround,t,state.history)      # once per control cycle
+#   if target.valid:
+#       (bodK.xSp,bodK.ySp) = wayHome(state,target)
+#
+#   state = vehicleState (or simVehicle) sampled this cycle
+#   zGround = ground level (m)
+#   t = time of the control cycle (s)
+#   history = poseHistory for stamped detections, None to use state
+#   getParam = parameter lookup, rospy.get_param if None
+#
+# Subscriptions:
+#   rospy.Subscriber('target_xySpStamped', PointStamped, self.cbTrackerStamped)
+#     or rospy.Subscriber('target_xySp', Point32, self.cbTracker) (unstamped,
+#     taken as captured at the next step)
+#   rospy.Subscriber('/autopilot/reloadParams', Empty, self.cbReload)
+#
+# ROS parameters (read at construction and on cbReload/loadParams only):
+#   /pix2m/altCal = altitude of the published setpoint scale (m)
+#   /targetKF/qAcc = pad acceleration noise (m/s^2)
+#   /targetKF/rPos = detection position noise (m)
+#   /targetKF/vInit = initial velocity uncertainty (m/s)
+#   /targetKF/gate = Mahalanobis gate on the innovation (chi-square, 2 dof)
+#   /targetKF/maxRejects = consecutive gated detections before re-initializing
+#   /targetKF/timeout = time without detections before the track is lost (s)
+#   /targetKF/minConf = confidence below which the track is not valid
+#
+# Fields:
+#   x, y = estimated pad position at the last step in local ENU (m)
+#   vx, vy = estimated pad velocity in local ENU coordinates (m/s)
+#   confidence = 0..1, rPos over the current position standard deviation
+#   valid = Boolean if the estimate can be used as setpoint (x, y keep the
+#           last estimate after the track is lost)
+#   detect = Boolean if a detection was fused this cycle
+#   xB, yB, zB = last detection message (body NED-h scaled to altCal, flag)
+#   stamp = capture time of the last detection message (None if unstamped)
+#   delay = age of the last fused detection when it was fused (s)
+#   accepted, rejected, stale = counts of fused, gated and out of order detections
+#
+#####
+
+class targetTracker:
+    def __init__(self,getParam=None):
+
+        self.getParam = getParam or rospy.get_param
+        self.loadParams()
+
+        self.xB = 0.0
+        self.yB = 0.0
+        self.zB = 0.0
+        self.stamp = None
+        self.measSeq = 0
+        self.usedSeq = 0
+
+        self.delay = 0.0
+        self.accepted = 0
+        self.rejected = 0
+        self.stale = 0
+        self.reset()
+
+    def loadParams(self):
+        kf = self.getParam('/targetKF')
+        self.altCal = self.getParam('/pix2m/altCal')
+        self.qAcc = kf['qAcc']
+        self.rPos = kf['rPos']
+        self.vInit = kf['vInit']
+        self.gate = kf['gate']
+        self.maxRejects = kf['maxRejects']
+        self.timeout = kf['timeout']
+        self.minConf = kf['minConf']
+
+    def cbReload(self,msg):
+        self.loadParams()
+
+    def cbTracker(self,msg):
+        if not msg == None:
+            self.measure(msg.x,msg.y,msg.z)
+
+    def cbTrackerStamped(self,msg):
+        if not msg == None:
+            self.measure(msg.point.x,msg.point.y,msg.point.z,msg.header.stamp.to_sec())
+
+    def measure(self,xB,yB,zB,stamp=None):
+        self.xB = xB
+        self.yB = yB
+        self.zB = zB
+        self.stamp = stamp
+        self.measSeq = self.measSeq + 1
+
+    def reset(self):
+        self.X = np.zeros(4)                                # x, y, vx, vy at self.t
+        self.P = np.eye(4)
+        self.initialized = False
+        self.t = None
+        self.misfits = 0
+        self.x = 0.0
+        self.y = 0.0
+        self.vx = 0.0
+        self.vy = 0.0
+        self.confidence = 0.0
+        self.valid = False
+        self.detect = False
+
+    def start(self,mx,my,t):
+        self.X = np.array([mx,my,0.0,0.0])
+        self.P = np.diag([self.rPos**2,self.rPos**2,self.vInit**2,self.vInit**2])
+        self.initialized = True
+        self.t = t
+        self.misfits = 0
+
+    def predict(self,X,P,dt):
+        if dt <= 0.0:
+            return X, P
+        F = np.eye(4)
+        F[0,2] = dt
+        F[1,3] = dt
+        q = self.qAcc**2
+        Q = np.zeros((4,4))
+        Q[0,0] = Q[1,1] = q*dt**4/4.0
+        Q[0,2] = Q[2,0] = Q[1,3] = Q[3,1] = q*dt**3/2.0
+        Q[2,2] = Q[3,3] = q*dt**2
+        return F.dot(X), F.dot(P).dot(F.T) + Q
+
+    def correct(self,mx,my,tc):
+        # gated measurement update at capture time tc, True if fused
+        (X,P) = self.predict(self.X,self.P,tc - self.t)
+        innov = np.array([mx - X[0],my - X[1]])
+        S = P[:2,:2] + self.rPos**2*np.eye(2)
+        Sinv = np.linalg.inv(S)
+        if innov.dot(Sinv).dot(innov) > self.gate:
+            self.misfits = self.misfits + 1
+            if self.misfits >= self.maxRejects:         # pad moved, start over
+                self.start(mx,my,tc)
+                return True
+            return False
+
+        K = P[:,:2].dot(Sinv)
+        self.X = X + K.dot(innov)
+        self.P = P - K.dot(P[:2,:])
+        self.t = tc
+        self.misfits = 0
+        return True
+
+    def step(self,pos,zGround,t,history=None):
+        self.detect = False
+        meas = None
+        if self.measSeq != self.usedSeq:                # new detection message
+            self.usedSeq = self.measSeq
+            tc = self.stamp
+            if tc is None or tc > t:
+                tc = t
+            if self.zB > 0 and self.initialized and tc <= self.t:
+                self.stale = self.stale + 1             # older than the last fused one
+            elif self.zB > 0:                           # positive detection
+                pose = pos
+                if history is not None and self.stamp is not None:
+                    pose = history.at(tc) or pos        # pose at capture time
+                alt = pose.z - zGround
+                (mx,my) = bodyToLocal(pose,self.xB*alt/self.altCal,self.yB*alt/self.altCal)
+                meas = (mx,my,tc)
+
+        if meas is not None:
+            (mx,my,tc) = meas
+            if not self.initialized:
+                self.start(mx,my,tc)
+                self.detect = True
+            else:
+                self.detect = self.correct(mx,my,tc)
+            if self.detect:
+                self.accepted = self.accepted + 1
+                self.delay = t - tc
+            else:
+                self.rejected = self.rejected + 1
+
+        if self.initialized:
+            (X,P) = self.predict(self.X,self.P,t - self.t)     # forward to now
+            (self.x,self.y,self.vx,self.vy) = X
+            sigma = sqrt(0.5*(P[0,0] + P[1,1]))
+            if t - self.t > self.timeout:               # lost, restart on next detection
+                self.confidence = 0.0
+                self.initialized = False
+            else:
+                self.confidence = min(1.0,self.rPos/sigma)
+        self.valid = self.initialized and self.confidence >= self.minConf
+        return self.valid
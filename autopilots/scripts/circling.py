@@ -12,7 +12,9 @@ from mavros_msgs.msg import *
 from mavros_msgs.srv import *
 
 import autopilotLib
+import flightLog
 import myLib
+import trajectoryLib
 
 ###################################
 
@@ -39,6 +41,10 @@ rospy.set_param('/kBodVel/yawOff',1.0)
 rospy.set_param('/kBodVel/yawCone',45.0)
 rospy.set_param('/kBodVel/yawTurnRate',15.0)
 
+# Telemetry recorded every control cycle
+LOG_FIELDS = ['t','phase','x','y','z','yaw','xSp','ySp','zSp','homeX','homeY',
+    'exInt','eyInt','ezInt','vx','vy','vz','yawRate','dt','cycleTime']
+
 ###################################
 
 # Main loop
@@ -50,27 +56,33 @@ def autopilot():
     setp = PositionTarget()
     setp.type_mask = int('010111000111', 2)
 
+    # Instantiate shared vehicle state
+    state = autopilotLib.vehicleState()
+    state.subscribe()
+
     # Instantiate altitude controller
-    altK = autopilotLib.kAltVel()
-    rospy.Subscriber('/mavros/local_position/pose', PoseStamped, altK.cbPos)
-    rospy.Subscriber('/mavros/state', State, altK.cbFCUstate)
+    altK = autopilotLib.kAltVel(state)
+    rospy.Subscriber('/autopilot/reloadParams', Empty, altK.cbReload)
 
     # Instantiate body controller
-    bodK = autopilotLib.kBodVel()
-    rospy.Subscriber('/mavros/local_position/pose', PoseStamped, bodK.cbPos)
-    rospy.Subscriber('/mavros/state', State, bodK.cbFCUstate)
+    bodK = autopilotLib.kBodVel(state)
+    rospy.Subscriber('/autopilot/reloadParams', Empty, bodK.cbReload)
 
-    # Establish a rate
+    # Establish a fixed-rate control loop
     fbRate = rospy.get_param('/main/fbRate')
-    rate = rospy.Rate(fbRate)
+    loop = autopilotLib.controlLoop(fbRate)
+
+    # Start telemetry recorder
+    flog = flightLog.flightLog(flightLog.logPath('circling'),LOG_FIELDS)
+    rospy.on_shutdown(flog.close)
 
     # Cycle to register local position
     kc = 0.0
-    while kc < 10: # cycle for subscribers to read local position
-        rate.sleep()
+    while kc < 10 and loop.wait(): # cycle for subscribers to read local position
         kc = kc + 1
 
-    zGround = altK.z
+    state.update()
+    zGround = state.z
 
     #####
     # Execute altitude step response while holding current position
@@ -78,50 +90,56 @@ def autopilot():
 
     altK.zSp = zGround + rospy.get_param('/main/altStep')
     home = myLib.xyVar()
-    home.x = bodK.x
-    home.y = bodK.y
+    home.x = state.x
+    home.y = state.y
 
-    while not abs(altK.zSp - altK.z) < 0.2 and not rospy.is_shutdown():
+    while not abs(altK.zSp - state.z) < 0.2 and loop.wait():
         
         setp.header.stamp = rospy.Time.now()
+        state.update()
 
-        setp.velocity.z = altK.controller()
-        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(bodK,home)
-        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller()
+        setp.velocity.z = altK.controller(loop.dt)
+        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(state,home)
+        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller(loop.dt)
 
-        rate.sleep()
         command.publish(setp)
-        
-        print 'Set/Alt/Gnd:',altK.zSp, altK.z, zGround
+        loop.done()
+
+        flog.record(loop.tStart,1,state.x,state.y,state.z,state.yaw,
+            bodK.xSp,bodK.ySp,altK.zSp,home.x,home.y,
+            bodK.exInt,bodK.eyInt,altK.ezInt,
+            setp.velocity.x,setp.velocity.y,setp.velocity.z,setp.yaw_rate,
+            loop.dt,loop.cycleTime)
         
         
     #####
     # Track circling trajectory
     #####
     
-    V = 4.0
-    omega = 0.1
-    theta = pi/2.0
-    home.x = 10.0
-    home.y = 15.0
+    path = trajectoryLib.circle((10.0,15.0),V=4.0,omega=0.1,theta0=pi/2.0)
+    tPath = None
     
-    while not rospy.is_shutdown():
+    while loop.wait():
     
         setp.header.stamp = rospy.Time.now()
-            
-        home.x = home.x + (1.0/fbRate)*V*cos(theta)
-        home.y = home.y + (1.0/fbRate)*V*sin(theta)
-        theta = theta + (1.0/fbRate)*omega
+        state.update()
+
+        if tPath is None:
+            tPath = loop.tStart         # reference time of the path
+        path.position(loop.tStart - tPath,home)
         
-        setp.velocity.z = altK.controller()
-        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(bodK,home)
-        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller()
+        setp.velocity.z = altK.controller(loop.dt)
+        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(state,home)
+        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller(loop.dt)
 
-        rate.sleep()
         command.publish(setp)
-        
-        error = sqrt((home.x - bodK.x)**2 + (home.y - bodK.y)**2)
-        print error, setp.velocity.x, setp.velocity.y, setp.yaw_rate
+        loop.done()
+
+        flog.record(loop.tStart,2,state.x,state.y,state.z,state.yaw,
+            bodK.xSp,bodK.ySp,altK.zSp,home.x,home.y,
+            bodK.exInt,bodK.eyInt,altK.ezInt,
+            setp.velocity.x,setp.velocity.y,setp.velocity.z,setp.yaw_rate,
+            loop.dt,loop.cycleTime)
         
 if __name__ == '__main__':
     try:
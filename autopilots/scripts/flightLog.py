@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+import numpy as np
+
+###################################
+#
+# class flightLog
+#   Per-cycle telemetry recorder. Records go into a preallocated ring buffer
+#   and a background thread appends them to a binary NumPy file, so the
+#   control loop never formats strings or touches the disk.
+#
+# Syntax:
+#   flog = flightLog(path,fields,size)
+#   flog.record(v1,v2,...)          # one value per field, in field order
+#   flog.close()                    # flush remaining records and stop
+#   data = readLog(path)            # structured array of all records
+#
+#   path = output file, written as consecutive np.save chunks
+#   fields = list of field names (stored as float64) or (name,dtype) pairs
+#   size = ring buffer length in records; the writer flushes the pending
+#          records every second, or sooner once size/2 are pending
+#
+# Fields:
+#   recorded = records passed to record()
+#   written = records flushed to disk
+#   lost = records overwritten before the writer caught up
+#
+#####
+
+class flightLog:
+    def __init__(self,path,fields,size=4096):
+        dtype = []
+        for field in fields:
+            if isinstance(field,tuple):
+                dtype.append(field)
+            else:
+                dtype.append((field,np.float64))
+        self.dtype = np.dtype(dtype)
+        self.fields = self.dtype.names
+        self.size = size
+        self.chunk = max(size//2,1)
+        self.buf = np.zeros(size,self.dtype)
+
+        self.recorded = 0
+        self.written = 0
+        self.lost = 0
+        self.flushed = 0                            # next record to write
+
+        self.path = path
+        self.file = open(path,'wb')
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.writeLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self,*values):
+        with self.cond:
+            if self.recorded - self.flushed >= self.size:   # writer fell behind
+                self.flushed = self.flushed + 1
+                self.lost = self.lost + 1
+            self.buf[self.recorded % self.size] = values
+            self.recorded = self.recorded + 1
+            if self.recorded - self.flushed >= self.chunk:
+                self.cond.notify()
+
+    def take(self):
+        # copy out pending records, oldest first (called with lock held)
+        start = self.flushed % self.size
+        n = self.recorded - self.flushed
+        if start + n <= self.size:
+            data = self.buf[start:start + n].copy()
+        else:
+            data = np.concatenate((self.buf[start:],self.buf[:start + n - self.size]))
+        self.flushed = self.recorded
+        return data
+
+    def writeLoop(self):
+        while True:
+            with self.cond:
+                if self.running and self.recorded - self.flushed < self.chunk:
+                    self.cond.wait(1.0)
+                data = self.take()
+                stopping = not self.running
+
+            if len(data) > 0:
+                np.save(self.file,data)
+                self.file.flush()
+                self.written = self.written + len(data)
+
+            if stopping:
+                break
+
+    def close(self):
+        if not self.running:
+            return
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        self.file.close()
+
+###################################
+#
+# function logPath
+#   Time stamped log file name in logDir (default $ROS_HOME or ~/.ros)
+#
+#####
+
+def logPath(name,logDir=None):
+    if logDir is None:
+        logDir = os.environ.get('ROS_HOME',os.path.join(os.path.expanduser('~'),'.ros'))
+    if not os.path.isdir(logDir):
+        os.makedirs(logDir)
+    return os.path.join(logDir,'%s-%s.npy' % (name,time.strftime('%Y%m%d-%H%M%S')))
+
+###################################
+#
+# function readLog
+#   Read back all records written by a flightLog
+#
+#####
+
+def readLog(path):
+    chunks = []
+    with open(path,'rb') as f:
+        while True:
+            try:
+                chunks.append(np.load(f))
+            except (IOError,ValueError,EOFError):
+                break
+    if not chunks:
+        return None
+    return np.concatenate(chunks)
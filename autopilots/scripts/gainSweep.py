@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+#####
+# Vectorized gain sweep of kAltVel/kBodVel on the simulated circling mission
+#
+# Every combination of the given gain ranges is flown in one batch and the
+# best candidates are listed by circling tracking error.
+#
+# Usage:
+#   gainSweep.py NAME=start:stop:count [NAME=...] [--top 10] [--climb 20] [--duration 60]
+#
+#   NAME = kAltVel_gP, kAltVel_gI, kBodVel_gP, kBodVel_gI, kBodVel_gPyaw,
+#          kBodVel_yawCone, ... (see simLib.SIM_PARAMS)
+#
+# Example:
+#   gainSweep.py kBodVel_gP=0.5:3:26 kBodVel_gI=0:0.5:11 kAltVel_gP=0.5:3:6
+#####
+
+from __future__ import print_function
+
+import argparse
+import time
+import numpy as np
+
+import simLib
+
+def gainGrid(ranges):
+    names = []
+    axes = []
+    for item in ranges:
+        (name,spec) = item.split('=')
+        (start,stop,count) = spec.split(':')
+        names.append(name)
+        axes.append(np.linspace(float(start),float(stop),int(count)))
+    mesh = np.meshgrid(*axes,indexing='ij')
+    return dict((name,values.ravel()) for (name,values) in zip(names,mesh))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Vectorized controller gain sweep')
+    parser.add_argument('ranges', nargs='+', help='NAME=start:stop:count')
+    parser.add_argument('--top', type=int, default=10, help='candidates to list')
+    parser.add_argument('--climb', type=float, default=20.0, help='altitude step phase (s)')
+    parser.add_argument('--duration', type=float, default=60.0, help='circling phase (s)')
+    args = parser.parse_args()
+
+    grid = gainGrid(args.ranges)
+    n = len(list(grid.values())[0])
+
+    t0 = time.time()
+    metrics = simLib.sweepCircling(simLib.simParams(),grid,args.climb,args.duration)
+    wall = time.time() - t0
+    print('%d candidates x %.0f s simulated in %.2f s' % (n,args.climb + args.duration,wall))
+
+    names = sorted(grid.keys())
+    print(' '.join('%14s' % name for name in names) +
+        ' %9s %9s %9s %9s' % ('settle s','overshoot','rmsErr','finalErr'))
+    for k in np.argsort(metrics['rmsErr'])[:args.top]:
+        print(' '.join('%14.3f' % grid[name][k] for name in names) +
+            ' %9.2f %9.3f %9.3f %9.3f' % (metrics['settle'][k],metrics['overshoot'][k],
+            metrics['rmsErr'][k],metrics['finalErr'][k]))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+#####
+# Run many simulated flights of the circling or tracking mission without
+# ROS and report tracking metrics and simulation throughput
+#
+# Usage:
+#   simFlights.py [circling|tracking] [--flights 100] [--duration 60]
+#                 [--seed 0] [--set kBodVel_gP=2.0 ...]
+#                 [--kalman] [--detect-every 1] [--latency 0.0] [--unstamped]
+#####
+
+from __future__ import print_function
+
+import argparse
+import time
+import numpy as np
+
+import simLib
+
+def runFlights(mission,flights,duration,params,seed=0,kalman=False,detectEvery=1,
+        latency=0.0,stamped=True):
+    rng = np.random.RandomState(seed)
+    results = []
+    for _ in range(flights):
+        veh = simLib.simVehicle(rng.uniform(-5.0,5.0),rng.uniform(-5.0,5.0),0.0,
+            rng.uniform(-np.pi,np.pi))
+        if mission == 'circling':
+            res = simLib.flyCircling(params,duration,veh)
+        else:
+            pad = simLib.simPad(veh.x + rng.uniform(-2.0,2.0),veh.y + rng.uniform(-2.0,2.0),
+                rng.uniform(-0.5,0.5),rng.uniform(-0.5,0.5))
+            res = simLib.flyTracking(params,duration,veh,pad,rng,kalman,detectEvery,
+                latency,stamped)
+        results.append(res)
+    return results
+
+def summarize(results):
+    table = {}
+    for name in ['climbTime','rmsErr','maxErr','finalErr']:
+        values = np.array([getattr(res,name) for res in results])
+        ok = values[~np.isnan(values)]
+        if len(ok) == 0:
+            table[name] = (np.nan,np.nan,np.nan,len(values))
+        else:
+            table[name] = (np.mean(ok),np.percentile(ok,95),np.max(ok),len(values) - len(ok))
+    return table
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline closed-loop flight simulation')
+    parser.add_argument('mission', nargs='?', default='circling', choices=['circling','tracking'])
+    parser.add_argument('--flights', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=60.0, help='flight time (s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--kalman', action='store_true', help='track the pad with targetTracker')
+    parser.add_argument('--detect-every', type=int, default=1, dest='detectEvery',
+        help='control cycles per camera frame')
+    parser.add_argument('--latency', type=float, default=0.0, help='capture to autopilot delay (s)')
+    parser.add_argument('--unstamped', action='store_true',
+        help='fuse detections at arrival time with the current pose')
+    parser.add_argument('--set', nargs='*', default=[], help='parameter overrides, e.g. kBodVel_gP=2.0')
+    args = parser.parse_args()
+
+    gains = {}
+    for item in args.set:
+        (key,value) = item.split('=')
+        gains[key] = float(value)
+    params = simLib.simParams(**gains)
+
+    t0 = time.time()
+    results = runFlights(args.mission,args.flights,args.duration,params,args.seed,
+        args.kalman,args.detectEvery,args.latency,not args.unstamped)
+    wall = time.time() - t0
+
+    print('%s: %d flights of %.0f s in %.2f s (%.0f flights/min, %.0fx real time)' % (
+        args.mission,args.flights,args.duration,wall,60.0*args.flights/wall,
+        args.flights*args.duration/wall))
+    print('%-10s %9s %9s %9s %6s' % ('metric','mean','p95','max','nan'))
+    for (name,(mean,p95,worst,bad)) in sorted(summarize(results).items()):
+        print('%-10s %9.3f %9.3f %9.3f %6d' % (name,mean,p95,worst,bad))
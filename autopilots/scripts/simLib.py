@@ -0,0 +1,516 @@
+import sys
+import types
+import collections
+import numpy as np
+
+from math import *
+
+###################################
+#
+# Offline closed-loop simulation of the autopilot controllers
+#
+# Runs kAltVel, kBodVel, wayHome and the circling/tracking mission logic
+# against a simple multirotor model as fast as the CPU allows. Without a
+# ROS installation, minimal stand-ins for the ROS modules imported by
+# autopilotLib are installed first (installRosStubs).
+#
+#####
+
+ROS_MODULES = ['rospy','tf','tf.transformations','std_msgs','std_msgs.msg',
+    'sensor_msgs','sensor_msgs.msg','geometry_msgs','geometry_msgs.msg',
+    'mavros_msgs','mavros_msgs.msg','mavros_msgs.srv',
+    'diagnostic_msgs','diagnostic_msgs.msg']
+
+class stubMsg(object):
+    def __init__(self,*args,**kwargs):
+        self.__dict__.update(kwargs)
+
+def stubEuler(q,axes='rzyx'):
+    (x,y,z,w) = q
+    return (atan2(2.0*(w*z + x*y),1.0 - 2.0*(y*y + z*z)),0.0,0.0)
+
+def stubParam(name,default=None):
+    if default is None:
+        raise KeyError('no ROS parameter server in simulation: %s' % name)
+    return default
+
+###################################
+#
+# function installRosStubs
+#   Register placeholder modules for any ROS module that cannot be imported
+#   so that autopilotLib can be loaded on a machine without ROS
+#
+#####
+
+def installRosStubs():
+    for name in ROS_MODULES:
+        try:
+            __import__(name)
+            continue
+        except ImportError:
+            pass
+
+        mod = types.ModuleType(name)
+        if name.endswith('.msg') or name.endswith('.srv'):
+            for msgName in ['DiagnosticArray','DiagnosticStatus','KeyValue',
+                    'PoseStamped','PointStamped','Point32','State','Empty',
+                    'PositionTarget','PointCloud','ChannelFloat32']:
+                setattr(mod,msgName,stubMsg)
+        sys.modules[name] = mod
+
+        if '.' in name:
+            (parent,child) = name.rsplit('.',1)
+            setattr(sys.modules[parent],child,mod)
+
+    rospy = sys.modules['rospy']
+    if not hasattr(rospy,'get_param'):
+        rospy.get_param = stubParam
+        rospy.Publisher = stubMsg
+        rospy.Subscriber = stubMsg
+        rospy.ServiceException = Exception
+    tft = sys.modules['tf.transformations']
+    if not hasattr(tft,'euler_from_quaternion'):
+        tft.euler_from_quaternion = stubEuler
+
+installRosStubs()
+
+import autopilotLib
+import myLib
+import trajectoryLib
+
+###################################
+#
+# Default parameters (same values as circling.py/tracking.py)
+#
+#####
+
+SIM_PARAMS = {
+    '/main/fbRate': 20.0,
+    '/main/altStep': 5.0,
+    '/kAltVel': {'gP': 1.5, 'gI': 0.1, 'vMaxU': 1.0, 'vMaxD': 0.5},
+    '/kBodVel': {'gP': 1.5, 'gI': 0.1, 'vMax': 5.0, 'gPyaw': 0.5,
+        'yawOff': 1.0, 'yawCone': 45.0, 'yawTurnRate': 15.0},
+    '/targetKF': {'qAcc': 0.5, 'rPos': 0.2, 'vInit': 1.0, 'gate': 9.21,
+        'maxRejects': 3, 'timeout': 2.0, 'minConf': 0.2},
+    '/pix2m/altCal': 1.2}
+
+def simParams(**gains):
+    # copy of SIM_PARAMS with e.g. kAltVel_gP=2.0 or main_fbRate=30.0 overrides
+    params = {}
+    for (key,value) in SIM_PARAMS.items():
+        params[key] = dict(value) if isinstance(value,dict) else value
+    for (key,value) in gains.items():
+        (ns,name) = key.split('_',1)
+        if isinstance(params.get('/' + ns),dict):
+            params['/' + ns][name] = value
+        else:
+            params['/' + ns + '/' + name] = value
+    return params
+
+###################################
+#
+# class simVehicle
+#   Multirotor kinematics with first-order response to velocity and yaw
+#   rate commands; a drop-in for vehicleState in the controllers
+#
+# Syntax:
+#   veh = simVehicle(x,y,z,yaw,tau,tauYaw)
+#   veh.step(vx,vy,vz,yawRate,dt)
+#
+#   vx,vy,vz = commanded velocity in local ENU (m/s)
+#   yawRate = commanded yaw rate (rad/s)
+#   tau, tauYaw = velocity and yaw rate time constants (s)
+#
+#   All arithmetic is element-wise, so positions and commands may also be
+#   NumPy arrays (one element per simulated vehicle).
+#
+# Fields:
+#   x, y, z, yaw = pose in local ENU, as in vehicleState
+#   vx, vy, vz, yawRate = current rates
+#   engaged = always True (armed and offboard)
+#   stamp = simulated time (s)
+#
+#####
+
+class simVehicle(object):
+    def __init__(self,x=0.0,y=0.0,z=0.0,yaw=0.0,tau=0.3,tauYaw=0.2,zGround=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.yaw = yaw
+        self.vx = 0.0*x
+        self.vy = 0.0*y
+        self.vz = 0.0*z
+        self.yawRate = 0.0*yaw
+        self.tau = tau
+        self.tauYaw = tauYaw
+        self.zGround = zGround
+        self.engaged = True
+        self.stamp = 0.0
+
+    def update(self):
+        pass
+
+    def step(self,vx,vy,vz,yawRate,dt):
+        a = min(dt/self.tau,1.0)
+        b = min(dt/self.tauYaw,1.0)
+        self.vx = self.vx + a*(vx - self.vx)
+        self.vy = self.vy + a*(vy - self.vy)
+        self.vz = self.vz + a*(vz - self.vz)
+        self.yawRate = self.yawRate + b*(yawRate - self.yawRate)
+
+        self.x = self.x + self.vx*dt
+        self.y = self.y + self.vy*dt
+        self.z = np.maximum(self.z + self.vz*dt,self.zGround)
+        self.yaw = np.arctan2(np.sin(self.yaw + self.yawRate*dt),np.cos(self.yaw + self.yawRate*dt))
+        self.stamp = self.stamp + dt
+
+###################################
+#
+# class simPad
+#   Moving landing pad (constant velocity plus optional circular motion)
+#   seen through a downward camera with limited field of view
+#
+# Syntax:
+#   pad = simPad(x,y,vx,vy,radius,omega)
+#   (x,y) = pad.position(t)
+#   target = pad.detect(veh,t,zGround,altCal,rng)
+#
+#   target = spTracker-like object with x,y (setpoint scaled to altCal as
+#            published by the vision node) and z = detection flag -1/+1
+#
+# Fields:
+#   fov = half-angle of the camera field of view (rad)
+#   pDetect = detection probability when in view
+#   noise = standard deviation of the detection error (m)
+#
+#####
+
+class simPad:
+    def __init__(self,x=0.0,y=0.0,vx=0.0,vy=0.0,radius=0.0,omega=0.0,
+            fov=radians(60.0),pDetect=0.9,noise=0.05):
+        self.x0 = x
+        self.y0 = y
+        self.vx = vx
+        self.vy = vy
+        self.radius = radius
+        self.omega = omega
+        self.fov = fov
+        self.pDetect = pDetect
+        self.noise = noise
+
+    def position(self,t):
+        x = self.x0 + self.vx*t + self.radius*cos(self.omega*t)
+        y = self.y0 + self.vy*t + self.radius*sin(self.omega*t)
+        return x, y
+
+    def detect(self,veh,t,zGround,altCal,rng):
+        target = autopilotLib.spTracker()
+        target.z = -1.0
+
+        pad = myLib.xyVar()
+        (pad.x,pad.y) = self.position(t)
+        (dx,dy) = autopilotLib.wayHome(veh,pad)             # body NED-h offset
+        alt = veh.z - zGround
+
+        if alt > 0.1 and hypot(dx,dy) < alt*tan(self.fov) and rng.rand() < self.pDetect:
+            dx = dx + self.noise*rng.randn()
+            dy = dy + self.noise*rng.randn()
+            target.x = dx*altCal/alt                        # as published at altCal
+            target.y = dy*altCal/alt
+            target.z = 1.0
+        return target
+
+###################################
+#
+# class simResult
+#   Time history and summary metrics of one simulated flight
+#
+# Fields:
+#   t, x, y, z, yaw, xRef, yRef, zRef, vx, vy, vz, yawRate = history arrays
+#   climbTime = time to reach the altitude step (s), nan if never
+#   rmsErr, maxErr = horizontal tracking error after the climb (m)
+#   finalErr = horizontal error at the end of the flight (m)
+#
+#####
+
+HISTORY = ['t','x','y','z','yaw','xRef','yRef','zRef','vx','vy','vz','yawRate']
+
+class simResult:
+    def __init__(self,n):
+        for name in HISTORY:
+            setattr(self,name,np.zeros(n))
+        self.n = 0
+        self.climbTime = np.nan
+        self.rmsErr = np.nan
+        self.maxErr = np.nan
+        self.finalErr = np.nan
+
+    def record(self,t,veh,xRef,yRef,zRef,cmd):
+        k = self.n
+        self.t[k] = t
+        self.x[k] = veh.x
+        self.y[k] = veh.y
+        self.z[k] = veh.z
+        self.yaw[k] = veh.yaw
+        self.xRef[k] = xRef
+        self.yRef[k] = yRef
+        self.zRef[k] = zRef
+        (self.vx[k],self.vy[k],self.vz[k],self.yawRate[k]) = cmd
+        self.n = k + 1
+
+    def finish(self):
+        for name in HISTORY:
+            setattr(self,name,getattr(self,name)[:self.n])
+        if self.n == 0:
+            return self
+        err = np.hypot(self.x - self.xRef,self.y - self.yRef)
+        if not np.isnan(self.climbTime):
+            err = err[self.t >= self.climbTime]
+        if len(err) > 0:
+            self.rmsErr = sqrt(np.mean(err**2))
+            self.maxErr = np.max(err)
+            self.finalErr = err[-1]
+        return self
+
+###################################
+#
+# function climb
+#   Altitude step while holding position (first phase of circling/tracking)
+#
+#####
+
+def climb(veh,altK,bodK,params,res,t,tEnd,dt):
+    zGround = veh.z
+    altK.zSp = zGround + params['/main/altStep']
+    home = myLib.xyVar()
+    home.x = veh.x
+    home.y = veh.y
+
+    while not abs(altK.zSp - veh.z) < 0.2 and t < tEnd:
+        vz = altK.controller(dt)
+        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(veh,home)
+        (vx,vy,yawRate) = bodK.controller(dt)
+        veh.step(vx,vy,vz,yawRate,dt)
+        t = t + dt
+        res.record(t,veh,home.x,home.y,altK.zSp,(vx,vy,vz,yawRate))
+
+    if abs(altK.zSp - veh.z) < 0.2:
+        res.climbTime = t
+    return t
+
+###################################
+#
+# function flyCircling
+#   Simulate circling.py: altitude step, then track a circling reference
+#
+# Syntax:
+#   res = flyCircling(params,duration,veh,V,omega)
+#
+#####
+
+def flyCircling(params=None,duration=60.0,veh=None,V=4.0,omega=0.1,center=(10.0,15.0)):
+    if params is None:
+        params = simParams()
+    if veh is None:
+        veh = simVehicle()
+    dt = 1.0/params['/main/fbRate']
+    altK = autopilotLib.kAltVel(veh,params.get)
+    bodK = autopilotLib.kBodVel(veh,params.get)
+    res = simResult(int(duration/dt) + 2)
+
+    t = climb(veh,altK,bodK,params,res,0.0,duration,dt)
+
+    path = trajectoryLib.circle(center,V,omega,pi/2.0)
+    home = myLib.xyVar()
+    tPath = t
+
+    while t < duration:
+        path.position(t + dt - tPath,home)
+
+        vz = altK.controller(dt)
+        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(veh,home)
+        (vx,vy,yawRate) = bodK.controller(dt)
+        veh.step(vx,vy,vz,yawRate,dt)
+        t = t + dt
+        res.record(t,veh,home.x,home.y,altK.zSp,(vx,vy,vz,yawRate))
+
+    return res.finish()
+
+###################################
+#
+# function flyTracking
+#   Simulate tracking.py: altitude step, then follow camera detections of
+#   a (possibly moving) pad, holding the last seen position on dropouts
+#
+# Syntax:
+#   res = flyTracking(params,duration,veh,pad,rng,kalman,detectEvery,latency,stamped)
+#
+#   kalman = follow a targetTracker estimate instead of raw detections
+#   detectEvery = control cycles per camera frame (vision node rate)
+#   latency = delay from image capture to the detection reaching the
+#             autopilot (s)
+#   stamped = give the tracker capture stamps and a pose history
+#   xRef, yRef in the result are the true pad position
+#
+#####
+
+def flyTracking(params=None,duration=60.0,veh=None,pad=None,rng=None,
+        kalman=False,detectEvery=1,latency=0.0,stamped=True):
+    if params is None:
+        params = simParams()
+    if veh is None:
+        veh = simVehicle()
+    if pad is None:
+        pad = simPad(2.0,1.0,0.3,0.0)
+    if rng is None:
+        rng = np.random.RandomState(0)
+    dt = 1.0/params['/main/fbRate']
+    altCal = params['/pix2m/altCal']
+    altK = autopilotLib.kAltVel(veh,params.get)
+    bodK = autopilotLib.kBodVel(veh,params.get)
+    tracker = autopilotLib.targetTracker(params.get)
+    history = autopilotLib.poseHistory()
+    inflight = collections.deque()                          # (tArrive,tCapture,target)
+    res = simResult(int(duration/dt) + 2)
+
+    zGround = veh.z
+    t = climb(veh,altK,bodK,params,res,0.0,duration,dt)
+
+    home = myLib.xyVar()
+    home.x = veh.x
+    home.y = veh.y
+
+    k = 0
+    target = autopilotLib.spTracker()
+    while t < duration:
+        history.record(t,veh.x,veh.y,veh.z,veh.yaw)
+        if k % detectEvery == 0:
+            inflight.append((t + latency,t,pad.detect(veh,t,zGround,altCal,rng)))
+        k = k + 1
+        while inflight and inflight[0][0] <= t + 1e-9:     # else last message holds
+            (_,tc,target) = inflight.popleft()
+            if stamped:
+                tracker.measure(target.x,target.y,target.z,tc)
+            else:
+                tracker.measure(target.x,target.y,target.z)
+
+        if kalman:
+            if tracker.step(veh,zGround,t,history if stamped else None):
+                (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(veh,tracker)
+                home.x = tracker.x
+                home.y = tracker.y
+            else:
+                (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(veh,home)
+        elif target.z > 0:
+            bodK.xSp = target.x*(veh.z - zGround)/tracker.altCal
+            bodK.ySp = target.y*(veh.z - zGround)/tracker.altCal
+            home.x = veh.x
+            home.y = veh.y
+        else:
+            (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(veh,home)
+
+        vz = altK.controller(dt)
+        (vx,vy,yawRate) = bodK.controller(dt)
+        veh.step(vx,vy,vz,yawRate,dt)
+        t = t + dt
+        (px,py) = pad.position(t)
+        res.record(t,veh,px,py,altK.zSp,(vx,vy,vz,yawRate))
+
+    return res.finish()
+
+###################################
+#
+# function batchGains
+#   Controller gain dicts for kAltVelBatch/kBodVelBatch from a parameter
+#   set and a grid of candidate values
+#
+# Syntax:
+#   (altGains,bodGains) = batchGains(params,grid)
+#
+#   grid = dict like {'kBodVel_gP': array, 'kAltVel_gI': array}, all arrays
+#          of the same length (one element per candidate)
+#
+#####
+
+def batchGains(params,grid):
+    gains = {'kAltVel': dict(params['/kAltVel']), 'kBodVel': dict(params['/kBodVel'])}
+    for (key,values) in grid.items():
+        (ns,name) = key.split('_',1)
+        gains[ns][name] = np.asarray(values,dtype=float)
+    return gains['kAltVel'], gains['kBodVel']
+
+###################################
+#
+# function sweepCircling
+#   Fly every candidate of a gain grid at once: a fixed-length altitude step
+#   while holding position, then the circling reference of circling.py
+#
+# Syntax:
+#   metrics = sweepCircling(params,grid,climb,duration,V,omega)
+#
+#   climb = length of the altitude step phase (s)
+#   duration = length of the circling phase (s)
+#
+# Return:
+#   metrics = dict of length-n arrays
+#     settle = altitude settling time into a 5% band (s), nan if never
+#     overshoot = altitude overshoot as fraction of the step
+#     rmsErr = horizontal tracking error over the circling phase (m)
+#     finalErr = mean horizontal error over the last 10 s (m)
+#
+#####
+
+def sweepCircling(params,grid,climb=20.0,duration=60.0,V=4.0,omega=0.1,center=(10.0,15.0)):
+    n = len(list(grid.values())[0])
+    fbRate = params['/main/fbRate']
+    dt = 1.0/fbRate
+    step = params['/main/altStep']
+    (altGains,bodGains) = batchGains(params,grid)
+
+    veh = simVehicle(np.zeros(n),np.zeros(n),np.zeros(n),np.zeros(n))
+    altK = autopilotLib.kAltVelBatch(n,altGains,fbRate,veh)
+    bodK = autopilotLib.kBodVelBatch(n,bodGains,fbRate,veh)
+    altK.zSp[:] = step
+
+    home = myLib.xyVar()                        # shared reference
+    home.x = 0.0
+    home.y = 0.0
+
+    # altitude step
+    kClimb = int(round(climb/dt))
+    lastOut = np.full(n,-1)
+    zMax = np.zeros(n)
+    for k in range(kClimb):
+        vz = altK.controller(dt)
+        (bodK.xSp,bodK.ySp) = autopilotLib.wayHomeBatch(veh,home)
+        (vx,vy,yawRate) = bodK.controller(dt)
+        veh.step(vx,vy,vz,yawRate,dt)
+        zMax = np.maximum(zMax,veh.z)
+        lastOut = np.where(np.abs(veh.z - step) > 0.05*step,k,lastOut)
+
+    settle = np.where(lastOut < kClimb - 1,(lastOut + 1)*dt,np.nan)
+    overshoot = np.maximum(zMax - step,0.0)/step
+
+    # circling
+    path = trajectoryLib.circle(center,V,omega,pi/2.0)
+    kCircle = int(round(duration/dt))
+    kFinal = max(kCircle - int(round(10.0/dt)),0)
+    sumSq = np.zeros(n)
+    sumFinal = np.zeros(n)
+    for k in range(kCircle):
+        path.position((k + 1)*dt,home)
+
+        vz = altK.controller(dt)
+        (bodK.xSp,bodK.ySp) = autopilotLib.wayHomeBatch(veh,home)
+        (vx,vy,yawRate) = bodK.controller(dt)
+        veh.step(vx,vy,vz,yawRate,dt)
+
+        err = np.hypot(veh.x - home.x,veh.y - home.y)
+        sumSq = sumSq + err**2
+        if k >= kFinal:
+            sumFinal = sumFinal + err
+
+    return {'settle': settle, 'overshoot': overshoot,
+        'rmsErr': np.sqrt(sumSq/max(kCircle,1)),
+        'finalErr': sumFinal/max(kCircle - kFinal,1)}
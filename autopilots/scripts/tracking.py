@@ -12,6 +12,7 @@ from mavros_msgs.msg import *
 from mavros_msgs.srv import *
 
 import autopilotLib
+import flightLog
 import myLib
 
 ###################################
@@ -39,6 +40,21 @@ rospy.set_param('/kBodVel/yawOff',1.0)
 rospy.set_param('/kBodVel/yawCone',45.0)
 rospy.set_param('/kBodVel/yawTurnRate',15.0)
 
+# ROS parameters for targetTracker
+rospy.set_param('/targetKF/qAcc',0.5)
+rospy.set_param('/targetKF/rPos',0.2)
+rospy.set_param('/targetKF/vInit',1.0)
+rospy.set_param('/targetKF/gate',9.21)
+rospy.set_param('/targetKF/maxRejects',3)
+rospy.set_param('/targetKF/timeout',2.0)
+rospy.set_param('/targetKF/minConf',0.2)
+
+# Telemetry recorded every control cycle
+LOG_FIELDS = ['t','phase','x','y','z','yaw','xSp','ySp','zSp','homeX','homeY',
+    'exInt','eyInt','ezInt','vx','vy','vz','yawRate','dt','cycleTime',
+    'targetX','targetY','targetZ','padX','padY','padVx','padVy','confidence','detect',
+    'delay']
+
 ###################################
 
 # Main loop
@@ -50,31 +66,38 @@ def autopilot():
     setp = PositionTarget()
     setp.type_mask = int('010111000111', 2)
 
+    # Instantiate shared vehicle state
+    state = autopilotLib.vehicleState()
+    state.subscribe()
+
     # Instantiate altitude controller
-    altK = autopilotLib.kAltVel()
-    rospy.Subscriber('/mavros/local_position/pose', PoseStamped, altK.cbPos)
-    rospy.Subscriber('/mavros/state', State, altK.cbFCUstate)
+    altK = autopilotLib.kAltVel(state)
+    rospy.Subscriber('/autopilot/reloadParams', Empty, altK.cbReload)
 
     # Instantiate body controller
-    bodK = autopilotLib.kBodVel()
-    rospy.Subscriber('/mavros/local_position/pose', PoseStamped, bodK.cbPos)
-    rospy.Subscriber('/mavros/state', State, bodK.cbFCUstate)
+    bodK = autopilotLib.kBodVel(state)
+    rospy.Subscriber('/autopilot/reloadParams', Empty, bodK.cbReload)
     
-    # Instantiate a tracker
-    target = autopilotLib.spTracker()
-    rospy.Subscriber('target_xySp', Point32, target.cbTracker)
+    # Instantiate a pad tracker
+    target = autopilotLib.targetTracker()
+    rospy.Subscriber('target_xySpStamped', PointStamped, target.cbTrackerStamped)
+    rospy.Subscriber('/autopilot/reloadParams', Empty, target.cbReload)
 
-    # Establish a rate
+    # Establish a fixed-rate control loop
     fbRate = rospy.get_param('/main/fbRate')
-    rate = rospy.Rate(fbRate)
+    loop = autopilotLib.controlLoop(fbRate)
+
+    # Start telemetry recorder
+    flog = flightLog.flightLog(flightLog.logPath('tracking'),LOG_FIELDS)
+    rospy.on_shutdown(flog.close)
 
     # Cycle to register local position
     kc = 0.0
-    while kc < 10: # cycle for subscribers to read local position
-        rate.sleep()
+    while kc < 10 and loop.wait(): # cycle for subscribers to read local position
         kc = kc + 1
 
-    zGround = altK.z        # define ground level
+    state.update()
+    zGround = state.z        # define ground level
 
     #####
     # Execute altitude step response while holding current position
@@ -82,49 +105,62 @@ def autopilot():
 
     altK.zSp = zGround + rospy.get_param('/main/altStep')
     home = myLib.xyVar()
-    home.x = bodK.x
-    home.y = bodK.y
+    home.x = state.x
+    home.y = state.y
 
-    while not abs(altK.zSp - altK.z) < 0.2 and not rospy.is_shutdown():
+    while not abs(altK.zSp - state.z) < 0.2 and loop.wait():
         
         setp.header.stamp = rospy.Time.now()
+        state.update()
 
-        setp.velocity.z = altK.controller()
-        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(bodK,home)
-        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller()
+        setp.velocity.z = altK.controller(loop.dt)
+        (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(state,home)
+        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller(loop.dt)
 
-        rate.sleep()
         command.publish(setp)
-        
-        print 'Set/Alt/Gnd:',altK.zSp, altK.z, zGround
+        loop.done()
+
+        flog.record(loop.tStart,1,state.x,state.y,state.z,state.yaw,
+            bodK.xSp,bodK.ySp,altK.zSp,home.x,home.y,
+            bodK.exInt,bodK.eyInt,altK.ezInt,
+            setp.velocity.x,setp.velocity.y,setp.velocity.z,setp.yaw_rate,
+            loop.dt,loop.cycleTime,target.xB,target.yB,target.zB,
+            target.x,target.y,target.vx,target.vy,target.confidence,target.detect,
+            target.delay)
         
         
     #####
     # Track camera detection
     #####
     
-    home.x = bodK.x                 # define home position
-    home.y = bodK.y
+    home.x = state.x                # define home position
+    home.y = state.y
     
-    while not rospy.is_shutdown():
+    while loop.wait():
     
         setp.header.stamp = rospy.Time.now()
+        state.update()
         
-        if target.z > 0:           # positive detection
-            bodK.xSp = target.x*(altK.z - zGround)/rospy.get_param('/pix2m/altCal')
-            bodK.ySp = target.y*(altK.z - zGround)/rospy.get_param('/pix2m/altCal')
-            home.x = bodK.x         # store most recent successful target
-            home.y = bodK.y
+        if target.step(state,zGround,loop.tStart,state.history):   # pad tracked or predicted
+            (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(state,target)
+            home.x = target.x       # store most recent pad estimate
+            home.y = target.y
         else:
-            (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(bodK,home)
+            (bodK.xSp,bodK.ySp) = autopilotLib.wayHome(state,home)
             
-        setp.velocity.z = altK.controller()
-        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller()
+        setp.velocity.z = altK.controller(loop.dt)
+        (setp.velocity.x,setp.velocity.y,setp.yaw_rate) = bodK.controller(loop.dt)
 
-        rate.sleep()
         command.publish(setp)
-        
-        print bodK.xSp, bodK.ySp, target.z
+        loop.done()
+
+        flog.record(loop.tStart,2,state.x,state.y,state.z,state.yaw,
+            bodK.xSp,bodK.ySp,altK.zSp,home.x,home.y,
+            bodK.exInt,bodK.eyInt,altK.ezInt,
+            setp.velocity.x,setp.velocity.y,setp.velocity.z,setp.yaw_rate,
+            loop.dt,loop.cycleTime,target.xB,target.yB,target.zB,
+            target.x,target.y,target.vx,target.vy,target.confidence,target.detect,
+            target.delay)
         
 if __name__ == '__main__':
     try:
@@ -0,0 +1,222 @@
+import numpy as np
+
+from math import *
+
+###################################
+#
+# class trajectory
+#   Reference path in local ENU coordinates as a function of elapsed time,
+#   sampled once on a uniform time grid and evaluated by linear
+#   interpolation, so a lookup costs the same for any pattern and a skipped
+#   control cycle does not shift the reference
+#
+# Syntax:
+#   path = trajectory(x,y,dt,periodic)
+#   (x,y) = path.at(t)
+#   path.position(t,home)           # home.x, home.y for wayHome
+#   (x,y) = path.at(tArray)         # arrays for batch controllers
+#
+#   x, y = positions at t = 0, dt, 2*dt, ... (m)
+#   dt = sample period of the grid (s)
+#   periodic = repeat the path after its duration, else hold the last point
+#
+# Fields:
+#   duration = time of the last sample (periodic: period of the path) (s)
+#   length = path length (m)
+#
+#####
+
+class trajectory:
+    def __init__(self,x,y,dt,periodic=False):
+        self.x = np.asarray(x,dtype=float)
+        self.y = np.asarray(y,dtype=float)
+        self.dt = dt
+        self.periodic = periodic
+        self.n = len(self.x)
+        if periodic:
+            self.duration = self.n*dt                   # last sample wraps to the first
+        else:
+            self.duration = (self.n - 1)*dt
+        self.length = np.sum(np.hypot(np.diff(self.x),np.diff(self.y)))
+
+    def index(self,t):
+        if self.periodic:
+            t = t % self.duration
+        else:
+            t = min(max(t,0.0),self.duration)
+        s = t/self.dt
+        k = int(s)
+        return k, s - k
+
+    def at(self,t):
+        if not np.isscalar(t):
+            return self.atBatch(np.asarray(t,dtype=float))
+        (k,f) = self.index(t)
+        k1 = k + 1
+        if k1 >= self.n:
+            k1 = 0 if self.periodic else self.n - 1
+        x = self.x[k] + f*(self.x[k1] - self.x[k])
+        y = self.y[k] + f*(self.y[k1] - self.y[k])
+        return x, y
+
+    def atBatch(self,t):
+        if self.periodic:
+            t = t % self.duration
+        else:
+            t = np.clip(t,0.0,self.duration)
+        s = t/self.dt
+        k = np.minimum(s.astype(int),self.n - 1)
+        f = s - k
+        k1 = k + 1
+        if self.periodic:
+            k1 = k1 % self.n
+        else:
+            k1 = np.minimum(k1,self.n - 1)
+        x = self.x[k] + f*(self.x[k1] - self.x[k])
+        y = self.y[k] + f*(self.y[k1] - self.y[k])
+        return x, y
+
+    def position(self,t,home):
+        (home.x,home.y) = self.at(t)
+        return home
+
+###################################
+#
+# function circle
+#   Circle flown at speed V and turn rate omega, starting at start with
+#   heading theta0 (the reference of circling.py, integrated exactly)
+#
+# Syntax:
+#   path = circle(start,V,omega,theta0,dt)
+#
+#   omega = turn rate (rad/s), ccw if positive; 0 raises ValueError (no
+#           closed path, use waypoints for a straight line)
+#
+#####
+
+def circle(start,V=4.0,omega=0.1,theta0=pi/2.0,dt=0.05):
+    if omega == 0.0:
+        raise ValueError('circle needs a nonzero turn rate omega')
+    period = 2.0*pi/abs(omega)
+    n = max(int(ceil(period/dt)),3)
+    dt = period/n
+    theta = theta0 + omega*dt*np.arange(n)
+    x = start[0] + V/omega*(np.sin(theta) - sin(theta0))
+    y = start[1] - V/omega*(np.cos(theta) - cos(theta0))
+    return trajectory(x,y,dt,periodic=True)
+
+###################################
+#
+# function figureEight
+#   Figure eight (lemniscate of Gerono) of half width a around center,
+#   one loop every 2*pi/omega seconds
+#
+# Syntax:
+#   path = figureEight(center,a,omega,heading,dt)
+#
+#   heading = direction of the long axis, ccw from local ENU x (rad)
+#   omega = loop rate (rad/s); 0 raises ValueError
+#
+#####
+
+def figureEight(center,a=10.0,omega=0.1,heading=0.0,dt=0.05):
+    if omega == 0.0:
+        raise ValueError('figureEight needs a nonzero loop rate omega')
+    period = 2.0*pi/abs(omega)
+    n = max(int(ceil(period/dt)),3)
+    dt = period/n
+    phase = omega*dt*np.arange(n)
+    u = a*np.sin(phase)
+    v = a*np.sin(phase)*np.cos(phase)
+    x = center[0] + u*cos(heading) - v*sin(heading)
+    y = center[1] + u*sin(heading) + v*cos(heading)
+    return trajectory(x,y,dt,periodic=True)
+
+###################################
+#
+# function waypoints
+#   Constant speed path through a list of (x,y) waypoints, either straight
+#   legs or a Catmull-Rom spline through the points
+#
+# Syntax:
+#   path = waypoints(points,V,spline,loop,dt)
+#
+#   points = sequence of (x,y) in local ENU (m)
+#   V = ground speed along the path (m/s)
+#   loop = close the path back to the first point and repeat it
+#
+#####
+
+def waypoints(points,V=2.0,spline=False,loop=False,dt=0.05):
+    pts = np.asarray(points,dtype=float)
+    if loop:
+        pts = np.vstack((pts,pts[:1]))
+    if spline and len(pts) > 2:
+        pts = catmullRom(pts,loop)
+    return resample(pts,V,dt,loop)
+
+def catmullRom(pts,loop=False,perLeg=20):
+    # dense polyline through pts (uniform Catmull-Rom)
+    if loop:
+        ext = np.vstack((pts[-2:-1],pts,pts[1:2]))
+    else:
+        ext = np.vstack((2*pts[0] - pts[1],pts,2*pts[-1] - pts[-2]))
+    s = np.linspace(0.0,1.0,perLeg,endpoint=False)[:,None]
+    s2 = s*s
+    s3 = s2*s
+    legs = []
+    for k in range(1,len(ext) - 2):
+        (p0,p1,p2,p3) = ext[k - 1:k + 3]
+        legs.append(0.5*(2*p1 + (p2 - p0)*s + (2*p0 - 5*p1 + 4*p2 - p3)*s2
+            + (3*p1 - p0 - 3*p2 + p3)*s3))
+    legs.append(pts[-1:])
+    return np.vstack(legs)
+
+def resample(pts,V,dt,periodic=False):
+    # positions every dt seconds at speed V along the polyline pts
+    seg = np.hypot(np.diff(pts[:,0]),np.diff(pts[:,1]))
+    arc = np.concatenate(([0.0],np.cumsum(seg)))
+    total = arc[-1]
+    if total <= 0.0:
+        return trajectory(pts[:1,0],pts[:1,1],dt,False)
+    n = max(int(ceil(total/(V*dt))),2)
+    dt = total/(V*n)                                # land exactly on the end
+    if periodic:
+        s = V*dt*np.arange(n)                       # last point wraps to the first
+    else:
+        s = V*dt*np.arange(n + 1)
+    x = np.interp(s,arc,pts[:,0])
+    y = np.interp(s,arc,pts[:,1])
+    return trajectory(x,y,dt,periodic)
+
+###################################
+#
+# function lawnmower
+#   Back and forth search pattern covering a width x height rectangle with
+#   passes spacing meters apart (e.g. the camera footprint)
+#
+# Syntax:
+#   path = lawnmower(origin,width,height,spacing,V,heading,dt)
+#
+#   origin = corner where the search starts, local ENU (m)
+#   width = length of each pass (m)
+#   height = extent across the passes (m)
+#   heading = direction of the first pass, ccw from local ENU x (rad)
+#
+#####
+
+def lawnmower(origin,width,height,spacing,V=2.0,heading=0.0,dt=0.05):
+    passes = int(floor(height/spacing)) + 1
+    pts = []
+    for k in range(passes):
+        v = min(k*spacing,height)
+        if k % 2 == 0:
+            pts.append((0.0,v))
+            pts.append((width,v))
+        else:
+            pts.append((width,v))
+            pts.append((0.0,v))
+    pts = np.array(pts)
+    x = origin[0] + pts[:,0]*cos(heading) - pts[:,1]*sin(heading)
+    y = origin[1] + pts[:,0]*sin(heading) + pts[:,1]*cos(heading)
+    return resample(np.column_stack((x,y)),V,dt)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+#####
+# Offline replay benchmark for the launch pad detector
+#
+# Runs detectorLib.padDetector over a video file or a directory of images
+# without camera or ROS and reports
+# 1) Wall time per detection stage
+# 2) Frames per second
+# 3) Agreement with labelled pad centers (see detectorLib.readLabels)
+# 4) With --nopad N, detections on N synthetic frames without a pad (bright
+#    gray patches on a dark background) replayed first; any detection
+#    there is a regression and makes the exit status 1
+#
+# Usage:
+#   benchDetector.py [SOURCE] [--labels FILE] [--nopad N] [--red 2] [--tol 10] [--repeat 1] [--roi]
+#                   [--pipeline DEPTH] [--buffers] [--budget MS] [--pyramid LEVEL]
+#                   [--flow FRAMES] [--adaptive] [--centroid moments|projection|blob]
+#                   [--candidates N] [--fusion POLICY] [--cues CUE,...]
+#####
+
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+import numpy as np
+import cv2
+
+import detectorLib
+
+def benchmark(source,labels=None,red=2,tol=10.0,repeat=1,width=640,roi=False,depth=0,buffers=False,
+        budget=None,pyramid=0,flow=0,adaptive=False,centroid='moments',
+        candidates=0,fusion='chain',cues=None,nopad=0):
+    dimx = width//red
+    frames = []
+    if source is not None:
+        frames = list(detectorLib.frameSource(source,dimx))
+        if not frames:
+            raise SystemExit('no frames found in %s' % source)
+        dimy = frames[0][1].shape[0]
+    else:
+        dimy = dimx*3//4
+    if nopad > 0:
+        negatives = noPadFrames(dimx,dimy,nopad)
+        if labels is None:
+            labels = {}
+        for (name,_) in negatives:
+            labels[name] = (-1.0,-1.0)
+        frames = negatives + frames
+
+    scheduler = None
+    if budget is not None:
+        scheduler = detectorLib.cueScheduler(budget/1000.0,parallel=depth > 0)
+    detector = detectorLib.padDetector(dimx,dimy,roiOn=roi,buffers=int(buffers),
+        scheduler=scheduler,pyramid=pyramid > 0,pyrLevels=pyramid,
+        flow=detectorLib.flowTracker(dimx,dimy,flow) if flow > 0 else None,adaptWhite=adaptive,
+        centroid=centroid,candidates=candidates)
+    detector.fusion.configure(policy=fusion)
+    if cues is not None:
+        detector.setCues(cues)
+    pipeline = None
+    if depth > 0:
+        pipeline = detectorLib.cuePipeline(detector,depth)
+
+    stageTimes = {}
+    totals = []
+    results = {}
+
+    for _ in range(repeat):
+        detector.reset()
+        for k in range(len(frames) + depth):
+            t0 = time.time()
+            if pipeline is None:
+                (name,frame) = frames[k]
+                det = detector.detect(frame)
+            elif k < len(frames):
+                out = pipeline.process(frames[k][1],frames[k][0])
+                if out is None:
+                    continue
+                (name,det) = out
+            else:
+                out = pipeline.collect()        # drain the pipeline
+                if out is None:
+                    break
+                (name,det) = out
+            totals.append(time.time() - t0)
+            for stage, dt in detector.times.items():
+                stageTimes.setdefault(stage,[]).append(dt)
+            results[name] = det
+    if pipeline is not None:
+        pipeline.stop()
+
+    report = {'frames': len(frames), 'repeat': repeat, 'stages': {}}
+    for stage, dts in stageTimes.items():
+        dts = 1000.0*np.array(dts)
+        report['stages'][stage] = (dts.mean(),np.median(dts),dts.max())
+    totals = np.array(totals)
+    report['fps'] = len(totals)/totals.sum()
+    report['msPerFrame'] = 1000.0*totals.mean()
+
+    if scheduler is not None:
+        report['level'] = (scheduler.level,scheduler.raises)
+    if detector.flow is not None:
+        tracked = sum(1 for det in results.values() if det.tracked)
+        report['flow'] = (tracked,detector.flow.seeds,detector.flow.lost)
+    if candidates > 0:
+        report['candidates'] = np.mean([len(det.candidates) for det in results.values()])
+
+    if labels is not None:
+        report['agreement'] = agreement(results,labels,red,tol)
+    if nopad > 0:
+        report['nopad'] = (sum(1 for (name,det) in results.items()
+            if name.startswith('nopad') and det.detect),nopad)
+
+    return report
+
+def noPadFrames(dimx,dimy,n,seed=0):
+    # scenes without a pad: a bright but not superwhite gray patch drifting
+    # over a dark textured background
+    rng = np.random.RandomState(seed)
+    frames = []
+    for k in range(n):
+        frame = rng.randint(40,80,(dimy,dimx,3)).astype(np.uint8)
+        frame = cv2.blur(frame,(5,5))
+        x = int(dimx*(0.3 + 0.4*k/float(max(n - 1,1))))
+        cv2.circle(frame,(x,dimy//2),dimy//8,(170,170,170),-1)
+        frames.append(('nopad%03d' % k,frame))
+    return frames
+
+def agreement(results,labels,red,tol):
+    counts = {'hit': 0, 'miss': 0, 'offset': 0, 'false': 0, 'reject': 0, 'unlabelled': 0}
+    errors = []
+
+    for name, det in results.items():
+        if name not in labels:
+            counts['unlabelled'] = counts['unlabelled'] + 1
+            continue
+        (lx,ly) = labels[name]
+        present = lx >= 0 and ly >= 0
+        if det.detect and present:
+            err = np.hypot(det.cx*red - lx,det.cy*red - ly)
+            errors.append(err)
+            if err <= tol:
+                counts['hit'] = counts['hit'] + 1
+            else:
+                counts['offset'] = counts['offset'] + 1
+        elif present:
+            counts['miss'] = counts['miss'] + 1
+        elif det.detect:
+            counts['false'] = counts['false'] + 1
+        else:
+            counts['reject'] = counts['reject'] + 1
+
+    labelled = len(results) - counts['unlabelled']
+    counts['rate'] = (counts['hit'] + counts['reject'])/float(max(labelled,1))
+    counts['meanError'] = np.mean(errors) if errors else 0.0
+    return counts
+
+def printReport(report):
+    print('frames: %d x %d' % (report['frames'],report['repeat']))
+    print('%-12s %9s %9s %9s' % ('stage','mean ms','median','max'))
+    for stage, (mean, median, worst) in sorted(report['stages'].items()):
+        print('%-12s %9.3f %9.3f %9.3f' % (stage,mean,median,worst))
+    print('total: %.3f ms/frame, %.1f frames/s' % (report['msPerFrame'],report['fps']))
+    if 'level' in report:
+        print('scheduler: final level %d, raised %d times' % report['level'])
+    if 'flow' in report:
+        print('flow: %d frames tracked, %d seeds, %d tracks lost' % report['flow'])
+    if 'candidates' in report:
+        print('candidates: %.1f per frame' % report['candidates'])
+
+    if 'agreement' in report:
+        a = report['agreement']
+        print('agreement: %.1f%% (hit %d, reject %d, miss %d, offset %d, false %d, unlabelled %d)' % (
+            100.0*a['rate'],a['hit'],a['reject'],a['miss'],a['offset'],a['false'],a['unlabelled']))
+        print('mean error of detections: %.1f px' % a['meanError'])
+    if 'nopad' in report:
+        print('no-pad frames: %d of %d detected%s' % (report['nopad'] +
+            (' (REGRESSION)' if report['nopad'][0] else '',)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay benchmark for the launch pad detector')
+    parser.add_argument('source', nargs='?', help='video file or directory of images')
+    parser.add_argument('--labels', help='name,x,y label file (full resolution pixels)')
+    parser.add_argument('--red', type=int, default=2, help='image size reduction')
+    parser.add_argument('--width', type=int, default=640, help='full resolution width')
+    parser.add_argument('--tol', type=float, default=10.0, help='hit tolerance (full resolution pixels)')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the source')
+    parser.add_argument('--roi', action='store_true', help='ROI tracking mode')
+    parser.add_argument('--pipeline', type=int, default=0, metavar='DEPTH',
+        help='run cues on parallel threads with DEPTH frames in flight')
+    parser.add_argument('--pyramid', type=int, default=0, metavar='LEVEL',
+        help='run the cues on pyramid LEVEL and refine at working resolution')
+    parser.add_argument('--budget', type=float, help='adaptive cue scheduling with a budget (ms/frame)')
+    parser.add_argument('--buffers', action='store_true', help='reuse preallocated working images')
+    parser.add_argument('--flow', type=int, default=0, metavar='FRAMES',
+        help='track the pad by optical flow for up to FRAMES frames between detections')
+    parser.add_argument('--adaptive', action='store_true', help='superwhite threshold from each frame histogram')
+    parser.add_argument('--centroid', default='moments', choices=['moments','projection','blob'],
+        help='superwhite centroid method')
+    parser.add_argument('--candidates', type=int, default=0, metavar='N',
+        help='keep up to N scored pad candidates per frame')
+    parser.add_argument('--fusion', default='chain', choices=detectorLib.FUSION_POLICIES,
+        help='cue fusion policy')
+    parser.add_argument('--cues', help='comma separated cues to run (default all: %s)' %
+        ','.join(detectorLib.FUSION_CUES))
+    parser.add_argument('--nopad', type=int, default=0, metavar='N',
+        help='replay N synthetic frames without a pad first and fail on any detection')
+    args = parser.parse_args()
+
+    cues = None
+    if args.cues:
+        cues = args.cues.split(',')
+
+    if args.source is None and args.nopad <= 0:
+        parser.error('SOURCE or --nopad is required')
+
+    labels = None
+    if args.labels:
+        labels = detectorLib.readLabels(args.labels)
+
+    report = benchmark(args.source,labels,args.red,args.tol,args.repeat,args.width,args.roi,args.pipeline,
+        args.buffers,args.budget,args.pyramid,args.flow,args.adaptive,
+        args.centroid,args.candidates,args.fusion,cues,args.nopad)
+    printReport(report)
+    if 'nopad' in report and report['nopad'][0] > 0:
+        sys.exit(1)
@@ -1,4 +1,14 @@
 import rospy
+import threading
+import time
+import numpy as np
+import cv2
+
+from sensor_msgs.msg import CompressedImage, PointCloud, ChannelFloat32
+from geometry_msgs.msg import Point32
+
+import detectorLib
+
 from math import *
 
 ###################################
@@ -6,6 +16,18 @@ from math import *
 # class pix2m 
 #   Convert pixel center to distance setpoint in body NED (m)
 #
+# Syntax:
+#   spGen = pix2m(calib)
+#   (xSp,ySp,flag) = spGen.targetFishEye(center)
+#   (xSp,ySp,flag) = spGen.targetFishEyeBatch(cx,cy)
+#
+#   calib = fisheye scale model, cm-per-pixel as a function of the pixel
+#           radius from the image center (default fishEyeScale)
+#   cx, cy = arrays of pixel centers (full resolution)
+#
+#   targetFishEye looks the setpoint up in per-pixel tables built once from
+#   LX, LY and calib; centers are rounded to the nearest pixel.
+#
 # Return:
 #   (xSp,ySp,flag) = position setpoint in body NED coordinates with -1/+1 flag
 #
@@ -17,13 +39,27 @@ from math import *
 #
 # Fields:
 #   LX, LY, m2pix
+#   xLUT, yLUT = body NED-h setpoint (m) of each pixel, indexed [y,x]
 #####
 
+def fishEyeScale(radius):
+    return 0.0019*radius + 0.1756                   # empirical data fit (cm/pixel)
+
 class pix2m():
-    def __init__(self):
+    def __init__(self,calib=fishEyeScale):
         self.LX = rospy.get_param('/pix2m/LX')
         self.LY = rospy.get_param('/pix2m/LY')
         self.m2pix = rospy.get_param('/pix2m/m2pix')
+        self.buildLUT(calib)
+
+    def buildLUT(self,calib):
+        self.calib = calib
+        px = np.arange(int(self.LX)) - self.LX/2        # pixel offsets from center
+        py = self.LY/2 - np.arange(int(self.LY))
+        xSp, ySp = np.meshgrid(px,py)
+        scale = calib(np.sqrt(xSp**2 + ySp**2))/100.0   # meters per pixel
+        self.xLUT = (ySp*scale).astype(np.float32)      # switch for NED
+        self.yLUT = (xSp*scale).astype(np.float32)
         
     def target(self,center):
         xSp = 0.0
@@ -46,19 +82,426 @@ class pix2m():
         xSp = 0.0
         ySp = 0.0
         flag = -1
-        
+
         if center.x > 0 and center.y > 0:
-            xSp = (center.x - self.LX/2)
-            ySp = (self.LY/2 - center.y)
-            radius = sqrt(xSp**2 + ySp**2)
-            scale = 0.0019*radius + 0.1756              # empirical data fit
-            xSp = xSp*scale                             # convert to centimeters
-            ySp = ySp*scale
-            xSp = xSp/100.0                             # convert to meters
-            ySp = ySp/100.0
-            hold = xSp                                  # switch for NED
-            xSp = ySp
-            ySp = hold
+            ix = min(int(center.x + 0.5),self.xLUT.shape[1] - 1)
+            iy = min(int(center.y + 0.5),self.xLUT.shape[0] - 1)
+            xSp = float(self.xLUT[iy,ix])
+            ySp = float(self.yLUT[iy,ix])
             flag = 1
 
         return [xSp,ySp,flag]
+
+    def targetFishEyeBatch(self,cx,cy):
+        cx = np.asarray(cx,dtype=np.float64)
+        cy = np.asarray(cy,dtype=np.float64)
+        valid = (cx > 0) & (cy > 0)
+
+        ix = np.clip(cx + 0.5,0,self.xLUT.shape[1] - 1).astype(np.intp)
+        iy = np.clip(cy + 0.5,0,self.xLUT.shape[0] - 1).astype(np.intp)
+        xSp = np.where(valid,self.xLUT[iy,ix],0.0)
+        ySp = np.where(valid,self.yLUT[iy,ix],0.0)
+        flag = np.where(valid,1,-1)
+
+        return xSp, ySp, flag
+
+###################################
+#
+# class frameGrabber
+#   Grab camera frames on a dedicated thread into a small preallocated ring
+#   buffer and always hand the consumer the newest frame (latest-frame-wins)
+#
+# Syntax:
+#   grabber = frameGrabber(cap,nBuf,lateAge,clock)
+#   grabber.start()
+#   (ok,frame,stamp,seq) = grabber.read(timeout)
+#   grabber.published(stamp)
+#   grabber.stop()
+#
+#   cap = opened cv2.VideoCapture (or anything with read(image))
+#   nBuf = number of ring buffer slots (>= 3)
+#   lateAge = age at which a consumed frame is counted as late (s)
+#   clock = time source used for stamps, e.g. rospy.get_time
+#
+#   The returned frame is a view into the ring and stays valid until the
+#   next call to read(); copy it if it must outlive the iteration.
+#
+# Fields:
+#   grabbed = number of frames read from the camera
+#   consumed = number of frames handed to the consumer
+#   dropped = frames overwritten before they were consumed
+#   late = consumed frames older than lateAge
+#   failed = failed camera reads
+#   latency = last capture-to-publish latency (s)
+#   latencyAvg = filtered capture-to-publish latency (s)
+#   latencyMax = worst capture-to-publish latency (s)
+#
+#####
+
+class frameGrabber:
+    def __init__(self,cap,nBuf=3,lateAge=0.1,clock=time.time):
+        self.cap = cap
+        self.nBuf = max(nBuf,3)
+        self.lateAge = lateAge
+        self.clock = clock
+
+        self.ring = [None]*self.nBuf                # allocated on first frame
+        self.stamps = [0.0]*self.nBuf
+        self.seqs = [0]*self.nBuf
+        self.newest = -1                            # slot of newest frame
+        self.held = -1                              # slot owned by consumer
+        self.seq = 0                                # last grabbed sequence
+        self.seqRead = 0                            # last consumed sequence
+
+        self.grabbed = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.late = 0
+        self.failed = 0
+        self.latency = 0.0
+        self.latencyAvg = 0.0
+        self.latencyMax = 0.0
+
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.grabLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(1.0)
+
+    def grabLoop(self):
+        while self.running:
+            with self.cond:                         # pick a free slot
+                slot = 0
+                while slot == self.newest or slot == self.held:
+                    slot = slot + 1
+
+            ok, image = self.cap.read(self.ring[slot])  # decode in place
+            stamp = self.clock()
+
+            if not ok or image is None:
+                self.failed = self.failed + 1
+                time.sleep(0.01)
+                continue
+
+            with self.cond:
+                self.ring[slot] = image             # same array unless resized
+                self.stamps[slot] = stamp
+                self.seq = self.seq + 1
+                self.seqs[slot] = self.seq
+                if self.newest >= 0 and self.seqs[self.newest] > self.seqRead:
+                    self.dropped = self.dropped + 1 # never handed out
+                self.newest = slot
+                self.grabbed = self.grabbed + 1
+                self.cond.notify_all()
+
+    def read(self,timeout=1.0):
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.running and self.seq == self.seqRead:
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    return False, None, 0.0, self.seqRead
+                self.cond.wait(remaining)
+
+            if self.newest < 0 or self.seq == self.seqRead:
+                return False, None, 0.0, self.seqRead
+
+            self.held = self.newest
+            self.seqRead = self.seqs[self.held]
+            stamp = self.stamps[self.held]
+            frame = self.ring[self.held]
+            self.consumed = self.consumed + 1
+
+        if self.clock() - stamp > self.lateAge:
+            self.late = self.late + 1
+
+        return True, frame, stamp, self.seqRead
+
+    def published(self,stamp):
+        self.latency = self.clock() - stamp
+        self.latencyAvg = 0.9*self.latencyAvg + 0.1*self.latency
+        self.latencyMax = max(self.latencyMax,self.latency)
+
+    def report(self):
+        return 'grabbed %d consumed %d dropped %d late %d failed %d latency %.1f/%.1f ms (avg/max)' % (
+            self.grabbed,self.consumed,self.dropped,self.late,self.failed,
+            1000.0*self.latencyAvg,1000.0*self.latencyMax)
+
+###################################
+#
+# class imageStreamer
+#   Rate limited CompressedImage publisher that converts and encodes frames
+#   on a background thread. offer() only copies the frame into a free
+#   buffer; if the encoder is still busy when a newer frame is offered, the
+#   waiting frame is dropped instead of blocking the caller.
+#
+# Syntax:
+#   streamer = imageStreamer(publisher,rate,fmt,quality,width,gray,clock)
+#   streamer.start()
+#   streamer.offer(frame,stamp)     # True if taken, False if rate limited
+#   streamer.stop()
+#
+#   publisher = rospy.Publisher of sensor_msgs/CompressedImage (queue_size=1
+#               so a slow link drops messages instead of queueing them)
+#   rate = maximum published frame rate (Hz)
+#   fmt = 'jpeg' or 'png'
+#   quality = JPEG quality (0-100) or PNG compression level (0-9)
+#   width = width frames are resized to, keeping aspect (None = as is)
+#   gray = convert BGR frames to grayscale before encoding
+#   clock = time source for rate limiting, e.g. rospy.get_time
+#
+# Fields:
+#   offered = frames taken by offer()
+#   published = frames encoded and published
+#   dropped = taken frames replaced by a newer one before encoding
+#   bytes = total encoded bytes published
+#   encodeTime = filtered conversion + encoding time per frame (s)
+#
+#####
+
+class imageStreamer:
+    def __init__(self,publisher,rate,fmt='jpeg',quality=80,width=None,gray=False,
+            clock=time.time):
+        self.publisher = publisher
+        self.period = 1.0/rate
+        self.fmt = fmt
+        if fmt == 'png':
+            self.ext = '.png'
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION,quality]
+        else:
+            self.ext = '.jpg'
+            self.params = [cv2.IMWRITE_JPEG_QUALITY,quality]
+        self.width = width
+        self.gray = gray
+        self.clock = clock
+
+        self.free = []                              # copy buffers not in use
+        self.nBufs = 0
+        self.pending = None                         # (buffer,stamp) to encode
+        self.tLast = None
+        self.grayBuf = None
+        self.smallBuf = None
+
+        self.offered = 0
+        self.published = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.encodeTime = 0.0
+
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.encodeLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(1.0)
+
+    def offer(self,frame,stamp):
+        now = self.clock()
+        if self.tLast is not None and now - self.tLast < self.period:
+            return False
+        self.tLast = now
+
+        with self.cond:
+            if self.free and self.free[-1].shape == frame.shape:
+                buf = self.free.pop()
+            else:
+                buf = None
+        if buf is None:                             # at most encoding + pending + filling
+            buf = np.empty_like(frame)
+            self.nBufs = self.nBufs + 1
+        np.copyto(buf,frame)
+
+        with self.cond:
+            if self.pending is not None:            # encoder busy, drop the older frame
+                self.free.append(self.pending[0])
+                self.dropped = self.dropped + 1
+            self.pending = (buf,stamp)
+            self.offered = self.offered + 1
+            self.cond.notify()
+        return True
+
+    def convert(self,img):
+        if self.gray and img.ndim == 3:
+            if self.grayBuf is None or self.grayBuf.shape != img.shape[:2]:
+                self.grayBuf = np.empty(img.shape[:2],np.uint8)
+            img = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY,dst=self.grayBuf)
+        if self.width is not None and img.shape[1] != self.width:
+            height = int(img.shape[0]*float(self.width)/img.shape[1])
+            shape = (height,self.width) + img.shape[2:]
+            if self.smallBuf is None or self.smallBuf.shape != shape:
+                self.smallBuf = np.empty(shape,np.uint8)
+            img = cv2.resize(img,(self.width,height),dst=self.smallBuf,
+                interpolation=cv2.INTER_AREA)
+        return img
+
+    def encodeLoop(self):
+        while True:
+            with self.cond:
+                while self.running and self.pending is None:
+                    self.cond.wait()
+                if not self.running:
+                    break
+                (buf,stamp) = self.pending
+                self.pending = None
+
+            t0 = time.time()
+            ok, data = cv2.imencode(self.ext,self.convert(buf),self.params)
+            self.encodeTime = 0.9*self.encodeTime + 0.1*(time.time() - t0)
+
+            with self.cond:
+                self.free.append(buf)
+
+            if not ok:
+                continue
+            msg = CompressedImage()
+            msg.header.stamp = rospy.Time.from_sec(stamp)
+            msg.format = self.fmt
+            msg.data = data.tobytes()
+            self.publisher.publish(msg)
+            self.published = self.published + 1
+            self.bytes = self.bytes + len(msg.data)
+
+    def report(self):
+        return 'offered %d published %d dropped %d %.0f kB encode %.1f ms' % (
+            self.offered,self.published,self.dropped,self.bytes/1024.0,1000.0*self.encodeTime)
+
+###################################
+#
+# function cuesToCloud, cloudToCues
+#   Pack the cues of a padDetection into a sensor_msgs/PointCloud and back,
+#   so detections can be drawn by a viewer on another thread or machine
+#
+# Syntax:
+#   msg = cuesToCloud(det,stamp,scale)
+#   det = cloudToCues(msg,scale)
+#
+#   stamp = capture time of the frame (s)
+#   scale = pixel scale applied to coordinates and radii, e.g. RED when
+#           packing (full resolution pixels) and image width/LX when unpacking
+#
+# Points (x,y in pixels, z = 0) with channels:
+#   cue = CUE_CENTER accepted pad center, CUE_CIRCLE Hough circle,
+#         CUE_WHITE superwhite centroid, CUE_CORNERS corner centroid,
+#         CUE_CORNER single corner
+#   radius = circle radius (pixels), 0 for other cues
+#
+#####
+
+CUE_CENTER = 0
+CUE_CIRCLE = 1
+CUE_WHITE = 2
+CUE_CORNERS = 3
+CUE_CORNER = 4
+
+def cuesToCloud(det,stamp,scale=1.0):
+    points = []
+    kinds = []
+    radii = []
+
+    def add(kind,x,y,r=0.0):
+        points.append(Point32(x*scale,y*scale,0.0))
+        kinds.append(kind)
+        radii.append(r*scale)
+
+    if det.detect:
+        add(CUE_CENTER,det.cx,det.cy)
+    if det.detectGRY:
+        add(CUE_CIRCLE,det.cxGRY,det.cyGRY,det.crGRY)
+    if det.detect255h:
+        add(CUE_WHITE,det.cx255h,det.cy255h)
+    if det.detectCRN:
+        add(CUE_CORNERS,det.cxCRN,det.cyCRN)
+        for (x,y) in det.corners:
+            add(CUE_CORNER,x,y)
+
+    msg = PointCloud()
+    msg.header.stamp = rospy.Time.from_sec(stamp)
+    msg.points = points
+    msg.channels = [ChannelFloat32('cue',kinds),ChannelFloat32('radius',radii)]
+    return msg
+
+def cloudToCues(msg,scale=1.0):
+    det = detectorLib.padDetection()
+    channels = dict((c.name,c.values) for c in msg.channels)
+    corners = []
+    for (p,kind,r) in zip(msg.points,channels['cue'],channels['radius']):
+        (x,y,r) = (p.x*scale,p.y*scale,r*scale)
+        kind = int(kind)
+        if kind == CUE_CENTER:
+            (det.detect,det.cx,det.cy) = (True,x,y)
+        elif kind == CUE_CIRCLE:
+            (det.detectGRY,det.cxGRY,det.cyGRY,det.crGRY) = (True,x,y,r)
+        elif kind == CUE_WHITE:
+            (det.detect255h,det.cx255h,det.cy255h) = (True,int(x),int(y))
+        elif kind == CUE_CORNERS:
+            (det.detectCRN,det.cxCRN,det.cyCRN) = (True,x,y)
+        elif kind == CUE_CORNER:
+            corners.append((x,y))
+    det.corners = np.array(corners).reshape(-1,2)
+    return det
+
+###################################
+#
+# function candidatesToCloud, cloudToCandidates
+#   Pack the scored pad candidates of a padDetection (detector candidates >
+#   0) into one sensor_msgs/PointCloud, so consumers can choose or track
+#   among all of them, and back
+#
+# Syntax:
+#   msg = candidatesToCloud(det,stamp,spGen,scale)
+#   candidates = cloudToCandidates(msg)
+#
+#   stamp = capture time of the frame (s)
+#   spGen = pix2m setpoint generator
+#   scale = working to full resolution pixel scale (RED)
+#   candidates = Nx6 (x,y,r,score,xSp,ySp), best first
+#
+# Points (xSp,ySp setpoint from spGen.targetFishEye, z = 0) with channels:
+#   x, y = candidate center (full resolution pixels)
+#   radius = candidate radius (full resolution pixels, 0 if unknown)
+#   score = summed cue weights agreeing on the candidate (see detectorLib.cueFusion)
+#
+#####
+
+def candidatesToCloud(det,stamp,spGen,scale=1.0):
+    msg = PointCloud()
+    msg.header.stamp = rospy.Time.from_sec(stamp)
+    cands = det.candidates
+    if cands is None:
+        cands = np.zeros((0,4))
+
+    x = cands[:,0]*scale
+    y = cands[:,1]*scale
+    (xSp,ySp,_) = spGen.targetFishEyeBatch(x,y)
+    msg.points = [Point32(u,v,0.0) for (u,v) in zip(xSp,ySp)]
+    msg.channels = [ChannelFloat32('x',x.tolist()),ChannelFloat32('y',y.tolist()),
+        ChannelFloat32('radius',(cands[:,2]*scale).tolist()),
+        ChannelFloat32('score',cands[:,3].tolist())]
+    return msg
+
+def cloudToCandidates(msg):
+    channels = dict((c.name,c.values) for c in msg.channels)
+    rows = [(x,y,r,score,p.x,p.y) for (p,x,y,r,score) in zip(msg.points,
+        channels['x'],channels['y'],channels['radius'],channels['score'])]
+    return np.array(rows,dtype=np.float64).reshape(-1,6)
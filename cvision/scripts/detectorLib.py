@@ -0,0 +1,1554 @@
+import os
+import time
+import threading
+import collections
+import numpy as np
+import cv2
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from math import sqrt
+
+# Check version of OpenCV
+
+if cv2.__version__.startswith('2'):
+    OLDCV = True
+else:
+    OLDCV = False
+
+if OLDCV:
+    import cv2.cv as cv
+    HOUGH_GRADIENT = cv.CV_HOUGH_GRADIENT
+    REDUCE_SUM = cv.CV_REDUCE_SUM
+    CV_32S = cv.CV_32S
+else:
+    HOUGH_GRADIENT = cv2.HOUGH_GRADIENT
+    REDUCE_SUM = cv2.REDUCE_SUM
+    CV_32S = cv2.CV_32S
+
+IMG_EXT = ('.png','.jpg','.jpeg','.bmp','.pgm','.ppm','.tif','.tiff')
+
+###################################
+#
+# class padDetection
+#   Result of one pass of the launch pad detector
+#
+# Fields:
+#   detect = Boolean if the fused detection is accepted
+#   cx, cy = accepted pad center in working pixels (-1 if none)
+#   detectGRY, cxGRY, cyGRY, crGRY = Hough circle cue on grayscale
+#   circles = all Hough circles kept as Nx3 (x,y,r), strongest first (None
+#             unless the detector keeps candidates)
+#   detect255h, cx255h, cy255h, m00 = superwhite centroid cue
+#   detectCRN, cxCRN, cyCRN, corners = corner cue (corners as Nx2 ints)
+#   gray = masked grayscale image the cues ran on (pyramid level in pyramid mode)
+#   mask = filtered superwhite mask
+#   full = masked grayscale at working resolution (same as gray at level 0)
+#   scale = 2**level of the pyramid level the cues ran on
+#   roi = (x0,y0,x1,y1) window the cues ran on (full frame if not tracking)
+#   bufs = imageBuffers holding gray and mask (None if allocated per frame)
+#   skip = cues not run on this frame; their results are held from the
+#          last frame they ran on (see cueScheduler)
+#   tracked = Boolean if the center was followed by optical flow (the
+#             corner cue then holds the tracked points, see flowTracker)
+#   candidates = Nx4 (x,y,r,score) pad candidates, best first (None unless
+#                the detector keeps candidates, see cueFusion.candidates)
+#   score = number of cues agreeing on the accepted center (see cueFusion)
+#   confirmed = Boolean if accepted by at least two agreeing cues right
+#               after an accepted frame (only these seed flow tracking)
+#   found = cue name -> candidates returned by its registered stage (cues
+#           added with registerCue, see FUSION_CUES)
+#
+#####
+
+class padDetection:
+    def __init__(self):
+        self.detect = False
+        self.cx = -1
+        self.cy = -1
+
+        self.detectGRY = False
+        self.cxGRY = -1
+        self.cyGRY = -1
+        self.crGRY = 0
+        self.circles = None
+
+        self.detect255h = False
+        self.cx255h = -1
+        self.cy255h = -1
+        self.m00 = 0.0
+
+        self.detectCRN = False
+        self.cxCRN = -1
+        self.cyCRN = -1
+        self.corners = None
+
+        self.gray = None
+        self.mask = None
+        self.full = None
+        self.scale = 1
+        self.roi = None
+        self.bufs = None
+        self.skip = ()
+        self.tracked = False
+        self.candidates = None
+        self.score = 0
+        self.confirmed = False
+        self.found = {}
+
+###################################
+#
+# class imageBuffers
+#   Working images of one detection, allocated once at the working
+#   resolution and reused frame after frame
+#
+# Syntax:
+#   bufs = imageBuffers(dimx,dimy)
+#   img = bufs.view(bufs.gray,(h,w))    # top left h x w window of a buffer
+#
+#   img = bufs.pyramid(level)           # grayscale pyramid level buffer
+#
+# Fields:
+#   gray = masked grayscale
+#   thr = superwhite threshold
+#   mask = filtered superwhite mask
+#   pyr = pyramid level buffers, allocated on first use
+#
+#####
+
+class imageBuffers:
+    def __init__(self,dimx,dimy):
+        self.dimx = dimx
+        self.dimy = dimy
+        self.gray = np.zeros((dimy,dimx), np.uint8)
+        self.thr = np.zeros((dimy,dimx), np.uint8)
+        self.mask = np.zeros((dimy,dimx), np.uint8)
+        self.pyr = {}
+
+    def view(self,buf,shape):
+        return buf[:shape[0],:shape[1]]
+
+    def pyramid(self,level):
+        if level not in self.pyr:
+            n = (1 << level) - 1                        # pyrDown rounds sizes up
+            self.pyr[level] = np.zeros(((self.dimy + n) >> level,(self.dimx + n) >> level), np.uint8)
+        return self.pyr[level]
+
+###################################
+#
+# class padDetector
+#   Launch pad detector independent of camera and ROS
+#   1) Fisheye (and proximity) masked grayscale
+#   2) Superwhite threshold + moments centroid
+#   3) Circle detection on grayscale
+#   4) Corner detection
+#   5) Acceptance logic fusing the three cues (cueFusion)
+#
+#   In ROI tracking mode the cues run only on a window around the previous
+#   detection (instead of the full-size proximity mask) and coordinates are
+#   translated back to the full frame. After roiMisses frames without a
+#   detection the search falls back to the full frame.
+#
+#   With buffers > 0 the working images come from a ring of preallocated
+#   imageBuffers and OpenCV writes into them in place, so a detection does
+#   not allocate any image. det.gray and det.mask are then only valid until
+#   the ring wraps around (buffers detections later).
+#
+#   With a cueScheduler the Hough and corner cues may be skipped on some
+#   frames to stay within a time budget; their last results are held.
+#
+#   In pyramid mode the cues run on a coarser pyramid level, chosen from the
+#   altitude so that the pad stays at least pyrMinRadius pixels there, and
+#   the Hough circle and superwhite centroid are then refined at working
+#   resolution in a small window around the coarse candidate.
+#
+#   With adaptWhite the superwhite threshold follows the exposure: a
+#   histogram of the masked grayscale gives the level of its brightest
+#   whiteQuantile pixels, the threshold sits whiteMargin below it (smoothed
+#   over frames, never under whiteMin). It only adapts while those pixels
+#   stand out at least whiteContrast levels above the median, i.e. the
+#   histogram has a real bright mode; otherwise it returns to white, so a
+#   merely brightest gray patch does not become superwhite. Masked out
+#   pixels are all 0, so dropping bin 0 limits the histogram to the fisheye
+#   (and proximity) masked region.
+#
+#   Once the altitude is known (setAltitude) and padRadius is given, the m00
+#   acceptance threshold follows the expected size of the pad instead of
+#   thresh: whiteFraction of its disc at that altitude (clipped to pxRad, the
+#   most the proximity mask or ROI lets through), at least whiteArea pixels.
+#
+#   The superwhite centroid is computed either with cv2.moments, from the
+#   row and column sums of the mask (same result, several times faster), or
+#   as the centroid of the largest blob only, so stray reflections do not
+#   drag it (external contours pick the blob, then only its own pixels are
+#   summed like the projections).
+#
+#   With candidates > 0 the Hough cue keeps up to that many circles (instead
+#   of only the strongest, which still drives the fused detection) and every
+#   detection also lists all circles and unmatched centroids as candidates
+#   scored by how many cues agree on them.
+#
+#   With a flowTracker a confirmed detection (det.confirmed: two agreeing
+#   cues, right after an accepted frame) seeds optical flow tracking and the
+#   following frames only track the pad, until the tracker asks for a full
+#   detection again (periodically or when the track degrades). A full
+#   detection that is not confirmed stops tracking.
+#
+# Syntax:
+#   detector = padDetector(dimx,dimy,femaskOn=True,...)
+#   det = detector.detect(frame)
+#
+#   frame = BGR image already reduced to dimx x dimy
+#
+# Fields:
+#   femaskOn = use fisheye mask
+#   thresh = m00 threshold for positive centroid detection (until the
+#            altitude is known)
+#   tol = radius multiplier for circle inclusion
+#   erode = use erode/dilate vs blur on the superwhite mask
+#   liberal = allow lone bright white detection (default chain fusion)
+#   hoverLow = allow corner only detection override (default chain fusion)
+#   pxRad = radius of the proximity mask (pixels)
+#   roiOn = restrict processing to a window around the last detection
+#   roiMargin = margin added around the pxRad window (pixels)
+#   roiMisses = consecutive misses before falling back to full frame
+#   pool = ring of imageBuffers (empty if allocating per frame)
+#   scheduler = cueScheduler deciding which cues run (None = all, always)
+#   pyramid = coarse-to-fine search on a grayscale pyramid
+#   pyrLevels = coarsest pyramid level used
+#   padRadius = pad radius in working pixels at 1 m altitude
+#   pyrMinRadius = smallest pad radius to search for on a coarse level (pixels)
+#   pyrLevel = pyramid level of the next detection (see setAltitude)
+#   flow = flowTracker following the pad between detections (None = off)
+#   adaptWhite = superwhite threshold from the histogram of each frame
+#   white = superwhite threshold level of the last frame (0-255)
+#   mThresh = m00 threshold in use at working resolution
+#   centroid = superwhite centroid method 'moments', 'projection' or 'blob'
+#   candidates = number of scored candidates kept per frame (0 = none)
+#   fusion = cueFusion accepting the detection (None = chain policy)
+#   disabled = cues turned off with setCues, e.g. per flight phase
+#   roi = current search window (x0,y0,x1,y1), None for full frame
+#   times = wall time of each stage in the last call (s)
+#   detectHold = acceptance of the previous frame
+#
+#####
+
+class padDetector:
+    def __init__(self,dimx,dimy,femaskOn=True,thresh=10000.0,tol=1.5,
+            erode=False,liberal=True,hoverLow=False,pxRad=None,
+            roiOn=False,roiMargin=20,roiMisses=5,buffers=0,scheduler=None,
+            pyramid=False,pyrLevels=2,padRadius=None,pyrMinRadius=15,flow=None,
+            adaptWhite=False,white=225,whiteQuantile=0.999,whiteMargin=30,whiteMin=210,
+            whiteContrast=80,whiteAlpha=0.3,whiteFraction=0.1,whiteArea=20,centroid='moments',
+            candidates=0,fusion=None):
+
+        self.dimx = dimx
+        self.dimy = dimy
+        self.femaskOn = femaskOn
+        self.thresh = thresh
+        self.tol = tol
+        self.erode = erode
+        self.liberal = liberal
+        self.hoverLow = hoverLow
+        if pxRad is None:
+            pxRad = dimy//4
+        self.pxRad = pxRad
+        self.roiOn = roiOn
+        self.roiMargin = roiMargin
+        self.roiMisses = roiMisses
+
+        # Create fisheye mask
+        self.FEmask = np.zeros((dimy,dimx), np.uint8)
+        cv2.circle(self.FEmask,(dimx//2,dimy//2),dimx//2,255,-1)
+
+        # Create erosion/dilation kernels
+        self.kernelE = np.ones((3,3),np.uint8)
+        self.kernelD = np.ones((3,3),np.uint8)
+
+        self.PXmask = np.zeros((dimy,dimx), np.uint8)
+        self.pxmaskOn = False
+        self.detectHold = False
+        self.roi = None
+        self.misses = 0
+
+        self.pool = []
+        self.slot = 0
+        self.allocBuffers(buffers)
+
+        self.scheduler = scheduler
+        self.pyramid = pyramid
+        self.pyrLevels = pyrLevels
+        self.padRadius = padRadius
+        self.pyrMinRadius = pyrMinRadius
+        self.pyrLevel = pyrLevels if pyramid else 0     # near the ground until told
+        self.heldGRY = (False,-1,-1,0,None)
+        self.heldCRN = (False,-1,-1,None)
+        self.flow = flow
+
+        self.adaptWhite = adaptWhite
+        self.white = white
+        self.whiteBase = white
+        self.whiteLevel = float(white)
+        self.whiteQuantile = whiteQuantile
+        self.whiteMargin = whiteMargin
+        self.whiteMin = whiteMin
+        self.whiteContrast = whiteContrast
+        self.whiteAlpha = whiteAlpha
+
+        self.whiteFraction = whiteFraction
+        self.whiteArea = whiteArea
+        self.mThresh = thresh
+
+        self.centroid = centroid
+        self.candidates = candidates
+
+        if fusion is None:
+            fusion = cueFusion('chain',tol,pxRad,liberal=liberal,hoverLow=hoverLow)
+        self.fusion = fusion
+        self.disabled = ()
+        self.xs = np.arange(dimx)
+        self.ys = np.arange(dimy)
+
+        self.times = {}
+        self.tLap = 0.0
+
+    def lap(self,stage):
+        now = time.time()
+        self.times[stage] = now - self.tLap
+        self.tLap = now
+
+    def allocBuffers(self,n):
+        # grow the ring of working images to at least n slots
+        while len(self.pool) < n:
+            self.pool.append(imageBuffers(self.dimx,self.dimy))
+
+    def nextBuffers(self):
+        if not self.pool:
+            return None
+        bufs = self.pool[self.slot]
+        self.slot = (self.slot + 1) % len(self.pool)
+        return bufs
+
+    def setAltitude(self,alt):
+        # m00 threshold from the expected pad size
+        if alt > 0.0 and self.padRadius is not None:
+            radius = min(self.padRadius/alt,self.pxRad)
+            area = self.whiteFraction*np.pi*radius**2
+            self.mThresh = 255.0*max(area,self.whiteArea)
+
+        # coarsest level on which the pad is still pyrMinRadius pixels
+        if not self.pyramid:
+            return
+        level = self.pyrLevels
+        if alt > 0.0 and self.padRadius is not None:
+            radius = self.padRadius/alt
+            level = 0
+            while level < self.pyrLevels and radius/2**(level + 1) >= self.pyrMinRadius:
+                level = level + 1
+        self.pyrLevel = level
+
+    def setCues(self,cues):
+        # run only the named cues, the others report no detection
+        self.disabled = tuple(cue for cue in FUSION_CUES if cue not in cues)
+        if 'hough' in self.disabled:
+            self.heldGRY = (False,-1,-1,0,None)
+        if 'corners' in self.disabled:
+            self.heldCRN = (False,-1,-1,None)
+        if self.scheduler is not None:
+            for cue in self.disabled:       # stale costs would inflate predictions
+                self.scheduler.costs.pop(cue,None)
+            if 'superwhite' in self.disabled:
+                self.scheduler.costs.pop('moments',None)
+
+    def reset(self):
+        self.pxmaskOn = False
+        self.detectHold = False
+        self.roi = None
+        self.misses = 0
+        self.heldGRY = (False,-1,-1,0,None)
+        self.heldCRN = (False,-1,-1,None)
+        self.whiteLevel = float(self.whiteBase)
+        if self.flow is not None:
+            self.flow.active = False
+
+    def detect(self,frame):
+        det = self.track(frame)
+        if det is not None:
+            return det
+
+        det = self.begin(frame)
+        for (name,cue) in FUSION_CUES.items():
+            if cue[0] is not None and name not in det.skip:
+                self.runCue(name,det,self.times)
+        self.tLap = time.time()
+
+        self.finish(det)
+        self.seed(frame,det)
+        return det
+
+    def runCue(self,name,det,times):
+        # run the stage of a registered cue on det.gray, timed under its name
+        t0 = time.time()
+        found = FUSION_CUES[name][0](self,det,times)
+        if found is not None:
+            det.found[name] = found
+        times.setdefault(name,time.time() - t0)
+
+    def track(self,frame):
+        # follow the pad by optical flow, None if a full detection is due
+        if self.flow is None or not self.flow.due():
+            return None
+        self.times = {}
+        self.tLap = time.time()
+
+        gray = self.flow.grayscale(frame)
+        if not self.flow.track(gray):
+            return None
+
+        det = padDetection()
+        det.detect = True
+        det.tracked = True
+        (det.cx,det.cy) = (self.flow.cx,self.flow.cy)
+        det.detectCRN = True
+        (det.cxCRN,det.cyCRN) = (int(det.cx),int(det.cy))
+        det.corners = np.intp(self.flow.points).reshape(-1,2)
+        det.gray = gray
+        det.full = gray
+        det.roi = (0,0,self.dimx,self.dimy)
+        if self.candidates > 0:
+            det.candidates = np.array([[det.cx,det.cy,0.0,1.0]])
+        self.updateMask(det)
+        self.lap('flow')
+        return det
+
+    def seed(self,frame,det):
+        # (re)start flow tracking from a confirmed full detection of frame
+        if self.flow is None:
+            return
+        if det.confirmed:
+            self.flow.seed(frame,det,self.tol,self.pxRad)
+        else:
+            self.flow.active = False
+
+    def begin(self,frame):
+        # start a detection: choose the search window and prepare grayscale
+        det = padDetection()
+        self.times = {}
+        self.tLap = time.time()
+
+        if self.roi is not None:
+            (x0,y0,x1,y1) = self.roi
+        else:
+            (x0,y0,x1,y1) = (0,0,self.dimx,self.dimy)
+        det.roi = (x0,y0,x1,y1)
+        det.bufs = self.nextBuffers()
+        if self.scheduler is not None:
+            det.skip = self.scheduler.plan()
+        if self.disabled:
+            det.skip = set(det.skip).union(self.disabled)
+
+        det.gray = self.prep(frame[y0:y1,x0:x1],det.roi,det.bufs)
+        det.full = det.gray
+        level = self.pyrLevel
+        if self.pyramid and level > 0:
+            det.gray = self.pyramidDown(det.full,level,det.bufs)
+            det.scale = 2**level
+        self.lap('prep')
+        return det
+
+    def pyramidDown(self,gray,level,bufs=None):
+        for l in range(1,level + 1):
+            dst = None
+            if bufs is not None:
+                dst = bufs.view(bufs.pyramid(l),((gray.shape[0] + 1)//2,(gray.shape[1] + 1)//2))
+            gray = cv2.pyrDown(gray,dst=dst)
+        return gray
+
+    def finish(self,det):
+        # fuse cues run on det.gray and update the search state
+        if det.scale > 1:
+            scaleCues(det,det.scale)
+            self.refine(det)
+
+        (x0,y0,_,_) = det.roi
+        if x0 > 0 or y0 > 0:
+            shiftCues(det,x0,y0)
+        self.holdCues(det)
+
+        self.fuse(det)
+        if self.candidates > 0:
+            det.candidates = self.fusion.candidates(det,self.candidates)
+        self.updateMask(det)
+        self.lap('fusion')
+
+        if self.scheduler is not None:
+            self.scheduler.update(self.times)
+
+    def refine(self,det):
+        # redo Hough circle and superwhite centroid at working resolution
+        # in a window around the coarse candidate
+        if det.detectGRY:
+            (cx,cy,r) = (det.cxGRY,det.cyGRY,det.crGRY)
+        elif det.detect255h:
+            (cx,cy,r) = (det.cx255h,det.cy255h,sqrt(det.m00/255.0/np.pi))
+        else:
+            return
+
+        (h,w) = det.full.shape
+        half = int(self.tol*r) + 2*det.scale
+        x0 = max(int(cx) - half,0)
+        y0 = max(int(cy) - half,0)
+        x1 = min(int(cx) + half + 1,w)
+        y1 = min(int(cy) + half + 1,h)
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return
+        win = det.full[y0:y1,x0:x1]
+
+        if det.detectGRY:
+            circles = cv2.HoughCircles(win,HOUGH_GRADIENT,1,self.dimy,param1=50,param2=80,
+                minRadius=max(int(r) - 2*det.scale,1),maxRadius=int(r) + 2*det.scale + 1)
+            if circles is not None:
+                temp = circles[0,0]
+                det.cxGRY = temp[0] + x0
+                det.cyGRY = temp[1] + y0
+                det.crGRY = temp[2]
+                if det.circles is not None:
+                    det.circles[0] = (det.cxGRY,det.cyGRY,det.crGRY)
+
+        if det.detect255h:
+            (m00,cx,cy) = self.maskCentroid(self.cueSuperwhite(win,level=self.white))
+            if m00 > 0:
+                det.cx255h = int(cx) + x0
+                det.cy255h = int(cy) + y0
+
+    def holdCues(self,det):
+        # fill skipped cues with their last result, remember the fresh ones
+        if 'hough' in det.skip:
+            (det.detectGRY,det.cxGRY,det.cyGRY,det.crGRY,det.circles) = self.heldGRY
+        else:
+            self.heldGRY = (det.detectGRY,det.cxGRY,det.cyGRY,det.crGRY,det.circles)
+
+        if 'corners' in det.skip:
+            (det.detectCRN,det.cxCRN,det.cyCRN,det.corners) = self.heldCRN
+        else:
+            self.heldCRN = (det.detectCRN,det.cxCRN,det.cyCRN,det.corners)
+
+    def prep(self,frame,roi,bufs=None):
+        (x0,y0,x1,y1) = roi
+
+        # convert to grayscale
+        if bufs is None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY,
+                dst=bufs.view(bufs.gray,frame.shape))
+
+        # apply fisheye mask (in place)
+        if self.femaskOn:
+            gray = cv2.bitwise_and(gray,self.FEmask[y0:y1,x0:x1],dst=gray)
+
+        # apply proximity mask (in place)
+        if self.pxmaskOn:
+            gray = cv2.bitwise_and(gray,self.PXmask,dst=gray)
+
+        return gray
+
+    def cueSuperwhite(self,gray,bufs=None,level=None):
+        if bufs is None:
+            thr = None
+            mask = None
+        else:
+            thr = bufs.view(bufs.thr,gray.shape)
+            mask = bufs.view(bufs.mask,gray.shape)
+
+        # extract superwhite
+        if level is None:
+            level = self.superwhiteLevel(gray)
+        _, mask255h = cv2.threshold(gray,level,255,cv2.THRESH_BINARY,dst=thr)
+
+        # filter superwhite using either erode/dilate or blur
+        if self.erode:
+            mask255h = cv2.erode(mask255h,self.kernelE,dst=mask,iterations = 1)
+            mask255h = cv2.dilate(mask255h,self.kernelD,dst=mask255h,iterations = 1)
+        else:
+            mask255h = cv2.blur(mask255h, (3,3),dst=mask)
+            _, mask255h =  cv2.threshold(mask255h,245,255,cv2.THRESH_BINARY,dst=mask255h)
+
+        return mask255h
+
+    def superwhiteLevel(self,gray):
+        # threshold level below the brightest pixels of the masked region
+        if not self.adaptWhite:
+            return self.white
+        hist = cv2.calcHist([gray],[0],None,[256],[0,256]).ravel()
+        hist[0] = 0
+        total = hist.sum()
+        if total > 0:
+            above = np.cumsum(hist[::-1])
+            top = 255 - int(np.searchsorted(above,(1.0 - self.whiteQuantile)*total))
+            median = 255 - int(np.searchsorted(above,0.5*total))
+            if top - median >= self.whiteContrast:     # bright mode stands out
+                level = max(top - self.whiteMargin,self.whiteMin)
+            else:
+                level = self.whiteBase
+            self.whiteLevel = self.whiteLevel + self.whiteAlpha*(level - self.whiteLevel)
+        self.white = min(int(round(self.whiteLevel)),254)
+        return self.white
+
+    def cueHough(self,gray,det):
+        # extract circles from grayscale
+        # (circles closer than minDist merge, so only one unless keeping candidates)
+        dimy = self.dimy//det.scale
+        minDist = dimy
+        if self.candidates > 0:
+            minDist = max(dimy//8,1)
+        circlesGRY = cv2.HoughCircles(gray,HOUGH_GRADIENT,1,minDist,
+            param1=50,param2=80,minRadius=dimy//50,maxRadius=dimy//4)
+
+        # assess circles
+        if circlesGRY is not None:
+            if self.candidates > 0:
+                det.circles = circlesGRY[0,:self.candidates].astype(np.float64)
+            temp = circlesGRY[0,0]
+            det.cxGRY = temp[0]
+            det.cyGRY = temp[1]
+            det.crGRY = temp[2]
+            det.detectGRY = True
+        else:
+            det.detectGRY = False
+
+    def cueMoments(self,mask,det):
+        # Compute superwhite centroids
+        (m00,cx,cy) = self.maskCentroid(mask,det.bufs)
+        det.m00 = m00
+
+        if m00 > self.mThresh/det.scale**2:
+            det.cx255h = int(cx)
+            det.cy255h = int(cy)
+            det.detect255h = True
+        else:
+            det.detect255h = False
+
+    def maskCentroid(self,mask,bufs=None):
+        # area (m00, 255 per pixel as cv2.moments) and centroid of a binary mask
+        if self.centroid == 'projection':
+            return self.projectionCentroid(mask)
+        if self.centroid == 'blob':
+            return self.blobCentroid(mask,bufs)
+
+        M = cv2.moments(mask)
+        if M['m00'] <= 0:
+            return 0.0, -1, -1
+        return M['m00'], M['m10']/M['m00'], M['m01']/M['m00']
+
+    def projectionCentroid(self,mask,x0=0,y0=0):
+        # first moments from the column and row sums
+        cols = cv2.reduce(mask,0,REDUCE_SUM,dtype=CV_32S).ravel()
+        rows = cv2.reduce(mask,1,REDUCE_SUM,dtype=CV_32S).ravel()
+        m00 = float(cols.sum())
+        if m00 <= 0:
+            return 0.0, -1, -1
+        cx = np.dot(cols,self.xs[:len(cols)])/m00 + x0
+        cy = np.dot(rows,self.ys[:len(rows)])/m00 + y0
+        return m00, cx, cy
+
+    def blobCentroid(self,mask,bufs=None):
+        # centroid of the largest blob (findContours may modify its input)
+        if bufs is None:
+            work = mask.copy()
+        else:
+            work = bufs.view(bufs.thr,mask.shape)
+            work[:] = mask
+        contours = cv2.findContours(work,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)[-2]
+        if not contours:
+            return 0.0, -1, -1
+        best = max(contours,key=cv2.contourArea)
+        (x,y,w,h) = cv2.boundingRect(best)
+
+        # keep only the pixels of the blob (its filled outline, holes excluded)
+        blob = work[y:y + h,x:x + w]
+        blob[:] = 0
+        cv2.drawContours(blob,[best],-1,255,-1,offset=(-x,-y))
+        cv2.bitwise_and(blob,mask[y:y + h,x:x + w],dst=blob)
+        return self.projectionCentroid(blob,x,y)
+
+    def cueCorners(self,gray,det):
+        # compute corners from grayscale
+        corners = cv2.goodFeaturesToTrack(gray,10,0.5,max(20//det.scale,1))
+        if corners is not None:
+            det.corners = np.intp(corners).reshape(-1,2)
+            temp = np.intp(det.corners.mean(axis=0))
+            det.cxCRN = temp[0]
+            det.cyCRN = temp[1]
+            det.detectCRN = True
+        else:
+            det.detectCRN = False
+
+    def fuse(self,det):
+        # detection acceptance logic
+        (det.detect,det.cx,det.cy,det.score) = self.fusion.fuse(det)
+        det.confirmed = det.detect and det.score >= 2 and self.detectHold
+
+    def updateMask(self,det):
+        if self.roiOn:
+            self.updateROI(det)
+            self.detectHold = det.detect
+            return
+
+        # Create proximity mask for next image
+        self.pxmaskOn = False
+        if det.detect and self.detectHold: # proximity mask of pxRad radius circle
+            self.PXmask[:] = 0
+            cv2.circle(self.PXmask,(int(det.cx),int(det.cy)),self.pxRad,255,-1)
+            self.pxmaskOn = True
+
+        # save for next iteration
+        self.detectHold = det.detect
+
+    def updateROI(self,det):
+        if det.detect:
+            self.misses = 0
+            if self.detectHold or self.roi is not None: # locked on the pad
+                half = self.pxRad + self.roiMargin
+                x0 = max(int(det.cx) - half,0)
+                y0 = max(int(det.cy) - half,0)
+                x1 = min(int(det.cx) + half + 1,self.dimx)
+                y1 = min(int(det.cy) + half + 1,self.dimy)
+                if x1 > x0 and y1 > y0:
+                    self.roi = (x0,y0,x1,y1)
+        else:
+            self.misses = self.misses + 1
+            if self.misses >= self.roiMisses:  # lost, back to full frame
+                self.roi = None
+
+###################################
+#
+# Cue registry of the padDetector: each cue is an image processing stage,
+# a candidate extractor for the fusion engine and the default score of its
+# candidates. detect, the cuePipeline workers and setCues run whatever is
+# registered; candidates are listed in registration order.
+#
+# Syntax:
+#   registerCue(name,stage,extract=None,score=1.0)
+#
+#   stage(detector,det,times) = runs the cue on det.gray and stores its
+#       results on det; it may return its candidates (see extract), which
+#       are then kept in det.found[name] and brought to working resolution
+#       and full frame coordinates with the built-in cues. times may take
+#       sub-stage timings (the stage is timed under its name otherwise).
+#       None for a cue that only reads the results of other cues.
+#   extract(det) = Nx3 (x,y,r) or Nx4 (x,y,r,score) candidates, or None
+#       (r = 0 if the cue has no radius); det.found[name] if omitted
+#   score = score of candidates without one
+#
+#####
+
+def superwhiteStage(detector,det,times):
+    t0 = time.time()
+    det.mask = detector.cueSuperwhite(det.gray,det.bufs)
+    t1 = time.time()
+    times['superwhite'] = t1 - t0
+    detector.cueMoments(det.mask,det)
+    times['moments'] = time.time() - t1
+
+def houghStage(detector,det,times):
+    detector.cueHough(det.gray,det)
+
+def cornerStage(detector,det,times):
+    detector.cueCorners(det.gray,det)
+
+def houghCandidates(det):
+    if not det.detectGRY:
+        return None
+    if det.circles is not None:
+        return det.circles
+    return np.array([[det.cxGRY,det.cyGRY,det.crGRY]])
+
+def superwhiteCandidates(det):
+    if not det.detect255h:
+        return None
+    return np.array([[det.cx255h,det.cy255h,0.0]])
+
+def cornerCandidates(det):
+    if not det.detectCRN:
+        return None
+    return np.array([[det.cxCRN,det.cyCRN,0.0]])
+
+FUSION_CUES = collections.OrderedDict()
+
+def registerCue(name,stage,extract=None,score=1.0):
+    if extract is None:
+        extract = lambda det: det.found.get(name)
+    FUSION_CUES[name] = (stage,extract,score)
+
+registerCue('hough',houghStage,houghCandidates)
+registerCue('superwhite',superwhiteStage,superwhiteCandidates)
+registerCue('corners',cornerStage,cornerCandidates)
+
+###################################
+#
+# class cueFusion
+#   Acceptance logic of the padDetector: fuse the candidates of the
+#   registered cues into one pad detection with a policy that can be
+#   changed at run time
+#
+#   'chain'     the original chain: circle + superwhite, circle + corners,
+#               superwhite + corners, then the liberal (lone superwhite)
+#               and hoverLow (corners only) overrides
+#   'vote'      each candidate scores, for every cue with a candidate
+#               agreeing with it (itself included), the best weighted score
+#               of these candidates; the best is accepted if it scores at
+#               least minScore, at the weighted mean of the candidates
+#               agreeing with it
+#   'nearest'   the closest agreeing pair of candidates from two different
+#               cues is accepted, at the candidate of the preferred cue
+#   'priority'  cues are tried in priority order and the first candidate
+#               agreed on by at least minCues cues (itself included) is
+#               accepted at its own position
+#
+#   Two candidates agree when they are closer than tol times the larger
+#   radius, or pxRad/2 if neither has one, as in the chain. The distances
+#   between all candidate pairs are computed at once. The weighted score of
+#   a candidate is its score (the registered default score of its cue if
+#   it has none) times the weight of its cue. Cues with weight 0 are left
+#   out of all policies but 'chain'.
+#
+# Syntax:
+#   fusion = cueFusion(policy,tol,pxRad,...)
+#   detector = padDetector(...,fusion=fusion)
+#   fusion.configure(policy='vote',weights={'corners': 0.5})
+#   (detect,cx,cy,score) = fusion.fuse(det)
+#   candidates = fusion.candidates(det,n)
+#
+#   score = number of cues agreeing on the accepted center (0 if none,
+#           1 for a lone cue such as the liberal and hoverLow overrides)
+#   candidates = Nx4 (x,y,r,score) pad candidates scored as 'vote' scores
+#                them, whatever the policy, highest first (ties keep the
+#                registration order), at most n rows; candidates agreeing
+#                with a better one are merged into it, at their weighted
+#                mean ('vote') or at the one of the preferred cue (other
+#                policies), r = the largest radius among them (0 if no cue
+#                gives one)
+#
+# Fields:
+#   policy = 'chain', 'vote', 'nearest' or 'priority'
+#   weights = cue name -> weight (missing cues weigh 1)
+#   minScore = summed weight needed to accept a candidate ('vote')
+#   minCues = agreeing cues needed to accept a candidate ('priority')
+#   priority = cue names, preferred first ('nearest', 'priority')
+#   liberal, hoverLow = overrides of the 'chain' policy
+#
+#####
+
+FUSION_POLICIES = ('chain','vote','nearest','priority')
+
+class cueFusion:
+    def __init__(self,policy='chain',tol=1.5,pxRad=60,weights=None,minScore=2.0,minCues=2,
+            priority=('hough','superwhite','corners'),liberal=True,hoverLow=False):
+        self.tol = tol
+        self.pxRad = pxRad
+        self.policy = 'chain'
+        self.weights = {}
+        self.minScore = minScore
+        self.minCues = minCues
+        self.priority = tuple(priority)
+        self.liberal = liberal
+        self.hoverLow = hoverLow
+        self.configure(policy,weights)
+
+    def configure(self,policy=None,weights=None,minScore=None,minCues=None,priority=None):
+        if policy is not None:
+            if policy not in FUSION_POLICIES:
+                raise ValueError('unknown fusion policy %s' % policy)
+            self.policy = policy
+        if weights is not None:
+            self.weights = dict(weights)
+        if minScore is not None:
+            self.minScore = minScore
+        if minCues is not None:
+            self.minCues = minCues
+        if priority is not None:
+            self.priority = tuple(priority)
+
+    def fuse(self,det):
+        if self.policy == 'chain':
+            return self.chain(det)
+
+        (names,pts,radii,cues,scores) = self.collect(det)
+        if len(pts) == 0:
+            return False, -1, -1, 0
+        (agree,dist) = self.agreement(pts,radii)
+
+        # byCue[i,c]: cue c has a candidate agreeing with candidate i
+        onehot = cues[:,None] == np.arange(len(names))
+        byCue = np.dot(agree.astype(np.int32),onehot.astype(np.int32)) > 0
+
+        if self.policy == 'vote':
+            (score,wa) = self.votes(names,cues,scores,agree)
+            best = int(np.argmax(score))
+            if score[best] < self.minScore:
+                return False, -1, -1, 0
+            wm = wa[best]
+            (cx,cy) = np.dot(wm,pts)/wm.sum()
+            return True, float(cx), float(cy), int(byCue[best].sum())
+
+        rank = np.array([self.rank(name) for name in names])[cues]
+        if self.policy == 'nearest':
+            pairs = agree & (cues[:,None] != cues[None,:])
+            if not pairs.any():
+                return False, -1, -1, 0
+            (i,j) = np.unravel_index(np.argmin(np.where(pairs,dist,np.inf)),dist.shape)
+            k = i if rank[i] <= rank[j] else j
+            return True, float(pts[k,0]), float(pts[k,1]), int(byCue[k].sum())
+
+        count = byCue.sum(axis=1)
+        for k in np.lexsort((np.arange(len(pts)),rank)):    # priority order, stable
+            if count[k] >= self.minCues:
+                return True, float(pts[k,0]), float(pts[k,1]), int(count[k])
+        return False, -1, -1, 0
+
+    def candidates(self,det,n):
+        (names,pts,radii,cues,scores) = self.collect(det)
+        if len(pts) == 0:
+            return np.zeros((0,4))
+        (agree,_) = self.agreement(pts,radii)
+        (score,wa) = self.votes(names,cues,scores,agree)
+        rank = np.array([self.rank(name) for name in names])[cues]
+        rows = []
+        merged = np.zeros(len(pts),bool)
+        for k in np.argsort(-score,kind='mergesort'):
+            if merged[k]:
+                continue
+            merged = merged | agree[k]
+            if self.policy == 'vote' and wa[k].sum() > 0.0:
+                (cx,cy) = np.dot(wa[k],pts)/wa[k].sum()
+            else:                       # at the preferred cue, as the other policies
+                group = np.flatnonzero(agree[k])
+                (cx,cy) = pts[group[np.argmin(rank[group])]]
+            rows.append((cx,cy,radii[agree[k]].max(),score[k]))
+            if len(rows) >= n:
+                break
+        return np.array(rows)
+
+    def votes(self,names,cues,scores,agree):
+        # score of each candidate: per cue, the best weighted score among
+        # its candidates agreeing with it; wa[i,j] = weighted score of j if
+        # it agrees with i
+        w = np.array([self.weights.get(name,1.0) for name in names])[cues]*scores
+        wa = np.where(agree,w[None,:],0.0)
+        score = sum(wa[:,cues == c].max(axis=1) for c in range(len(names)))
+        return score, wa
+
+    def rank(self,name):
+        if name in self.priority:
+            return self.priority.index(name)
+        return len(self.priority)
+
+    def collect(self,det):
+        # candidates of all cues with a weight, as arrays
+        names = []
+        rows = []
+        cues = []
+        for (name,(_,extract,score)) in FUSION_CUES.items():
+            if self.weights.get(name,1.0) <= 0.0:
+                continue
+            cand = extract(det)
+            if cand is None or len(cand) == 0:
+                continue
+            cand = np.asarray(cand,dtype=np.float64)
+            cand = cand.reshape(len(cand),-1)
+            if cand.shape[1] < 4:
+                cand = np.hstack((cand[:,:3],np.full((len(cand),1),float(score))))
+            cues.extend([len(names)]*len(cand))
+            names.append(name)
+            rows.append(cand[:,:4])
+        if not rows:
+            return names, np.zeros((0,2)), np.zeros(0), np.zeros(0,np.intp), np.zeros(0)
+        cand = np.vstack(rows)
+        return names, cand[:,:2], cand[:,2], np.array(cues,np.intp), cand[:,3]
+
+    def agreement(self,pts,radii):
+        # pairwise distances and agreement of all candidates
+        dist = np.hypot(pts[:,None,0] - pts[None,:,0],pts[:,None,1] - pts[None,:,1])
+        r = np.maximum(radii[:,None],radii[None,:])
+        reach = np.where(r > 0,self.tol*r,self.pxRad/2.0)
+        return dist < reach, dist
+
+    def chain(self,det):
+        # the original acceptance chain
+        Detect = False
+        Skip = False
+        CX = -1
+        CY = -1
+        Score = 0
+
+        if det.detectGRY and det.detect255h: # Greyscale circle + Superwhite centroid
+            error = (det.cxGRY - det.cx255h)**2 + (det.cyGRY - det.cy255h)**2
+            if sqrt(error) < self.tol*det.crGRY:
+                Detect = True
+                CX = det.cxGRY
+                CY = det.cyGRY
+                Skip = True
+
+        if det.detectGRY and det.detectCRN and not Skip: # Greyscale circle + Corners
+            error = (det.cxGRY - det.cxCRN)**2 + (det.cyGRY - det.cyCRN)**2
+            if sqrt(error) < self.tol*det.crGRY:
+                Detect = True
+                CX = det.cxGRY
+                CY = det.cyGRY
+                Skip = True
+
+        if det.detect255h and det.detectCRN and not Skip: # Superwhite centroid + Corners
+            error = (det.cx255h - det.cxCRN)**2 + (det.cy255h - det.cyCRN)**2
+            if sqrt(error) < self.pxRad/2:
+                Detect = True
+                CX = det.cx255h
+                CY = det.cy255h
+                Skip = True
+
+        if Skip: # a pair of cues agrees
+            Score = 2
+
+        if self.liberal:
+            if det.detect255h and not det.detectGRY and not det.detectCRN and not Skip:
+                Detect = True
+                CX = det.cx255h
+                CY = det.cy255h
+                Score = 1
+
+        if self.hoverLow:
+            if det.detectCRN:
+                Detect = True
+                CX = det.cxCRN
+                CY = det.cyCRN
+                Score = 1
+
+        return Detect, CX, CY, Score
+
+###################################
+#
+# class flowTracker
+#   Follow a confirmed pad from frame to frame with pyramidal Lucas-Kanade
+#   optical flow instead of rerunning the full detector
+#
+#   The tracker is seeded from a confirmed detection with the corners of
+#   its goodFeaturesToTrack cue that lie on the pad (topped up with weaker
+#   corners around the pad center if there are too few). Each frame the
+#   points are tracked forward and back again; points lost by the flow or
+#   not returning within maxError pixels are dropped. The pad center is
+#   carried along by the similarity (shift, rotation, scale) that maps the
+#   seeded points onto the tracked ones.
+#
+#   Tracking stops, and the detector runs in full again, after redetect
+#   frames or as soon as fewer than minPoints points (or less than
+#   minFraction of the seeds) survive, or the points stop moving rigidly
+#   (rms residual above maxResidual pixels).
+#
+# Syntax:
+#   flow = flowTracker(dimx,dimy,redetect,...)
+#   detector = padDetector(...,flow=flow)
+#
+#   redetect = frames tracked between full detections
+#   winSize = Lucas-Kanade window (pixels)
+#   maxLevel = coarsest pyramid level of the flow
+#
+# Fields:
+#   active = Boolean if seeded and following the pad
+#   age = frames tracked since the last seed
+#   points = tracked points (Nx1x2 float32)
+#   cx, cy = tracked pad center in working pixels
+#   residual = rms distance of the points from the fitted motion (pixels)
+#   seeds, lost = number of seeds and of tracks lost
+#
+#####
+
+class flowTracker:
+    def __init__(self,dimx,dimy,redetect=10,minPoints=4,minFraction=0.5,
+            maxError=1.0,maxResidual=2.0,winSize=15,maxLevel=2,maxCorners=20):
+        self.dimx = dimx
+        self.dimy = dimy
+        self.redetect = redetect
+        self.minPoints = minPoints
+        self.minFraction = minFraction
+        self.maxError = maxError
+        self.maxResidual = maxResidual
+        self.winSize = (winSize,winSize)
+        self.maxLevel = maxLevel
+        self.maxCorners = maxCorners
+
+        # previous and current grayscale, swapped every frame
+        self.grays = [np.zeros((dimy,dimx), np.uint8) for _ in range(2)]
+        self.cur = 0
+
+        self.active = False
+        self.age = 0
+        self.points = None
+        self.anchors = None     # seeded positions of the points
+        self.center = None      # seeded pad center
+        self.nSeed = 0
+        self.cx = -1
+        self.cy = -1
+        self.residual = 0.0
+        self.seeds = 0
+        self.lost = 0
+
+    def due(self):
+        return self.active and self.age < self.redetect
+
+    def stop(self):
+        if self.active:
+            self.lost = self.lost + 1
+        self.active = False
+
+    def grayscale(self,frame):
+        # convert into the buffer not holding the previous frame
+        gray = self.grays[1 - self.cur]
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        return gray
+
+    def seed(self,frame,det,tol=1.5,pxRad=None):
+        # start following det from frame (det in working pixels)
+        self.active = False
+        if not det.detect:
+            return False
+
+        gray = self.grays[self.cur]
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+        if det.crGRY > 0:
+            radius = tol*det.crGRY
+        elif pxRad is not None:
+            radius = pxRad
+        else:
+            radius = self.dimy//4
+        center = np.array([det.cx,det.cy], np.float32)
+
+        points = np.zeros((0,2), np.float32)
+        if det.corners is not None:
+            points = det.corners.astype(np.float32)
+            points = points[np.hypot(*(points - center).T) <= radius]
+
+        if len(points) < self.minPoints:
+            # weaker corners in a window around the pad center
+            x0 = max(int(det.cx - radius),0)
+            y0 = max(int(det.cy - radius),0)
+            x1 = min(int(det.cx + radius) + 1,self.dimx)
+            y1 = min(int(det.cy + radius) + 1,self.dimy)
+            if x1 - x0 > 8 and y1 - y0 > 8:
+                extra = cv2.goodFeaturesToTrack(gray[y0:y1,x0:x1],self.maxCorners,0.05,5)
+                if extra is not None:
+                    extra = extra.reshape(-1,2) + np.array([x0,y0], np.float32)
+                    points = np.vstack((points,extra))
+
+        if len(points) < self.minPoints:
+            return False
+
+        self.points = points.reshape(-1,1,2).astype(np.float32)
+        self.anchors = points.reshape(-1,2).astype(np.float32)
+        self.center = center
+        self.nSeed = len(points)
+        (self.cx,self.cy) = (det.cx,det.cy)
+        self.residual = 0.0
+        self.age = 0
+        self.active = True
+        self.seeds = self.seeds + 1
+        return True
+
+    def track(self,gray):
+        # follow the points into gray, False (and inactive) if the track is lost
+        prev = self.grays[self.cur]
+        p1, st1, _ = cv2.calcOpticalFlowPyrLK(prev,gray,self.points,None,
+            winSize=self.winSize,maxLevel=self.maxLevel)
+        if p1 is None:
+            self.stop()
+            return False
+        p0, st0, _ = cv2.calcOpticalFlowPyrLK(gray,prev,p1,None,
+            winSize=self.winSize,maxLevel=self.maxLevel)
+        back = np.abs(p0 - self.points).reshape(-1,2).max(axis=1)
+        good = (st1.ravel() == 1) & (st0.ravel() == 1) & (back < self.maxError)
+
+        n = int(good.sum())
+        if n < self.minPoints or n < self.minFraction*self.nSeed:
+            self.stop()
+            return False
+
+        anchors = self.anchors[good]
+        points = p1.reshape(-1,2)[good]
+
+        # similarity from the seeded points, as complex numbers z -> a*z + b
+        za = anchors[:,0] + 1j*anchors[:,1]
+        zp = points[:,0] + 1j*points[:,1]
+        ma = za.mean()
+        mp = zp.mean()
+        da = za - ma
+        norm = np.vdot(da,da).real
+        if norm <= 0.0:
+            self.stop()
+            return False
+        a = np.vdot(da,zp - mp)/norm
+        residual = sqrt(np.mean(np.abs(zp - mp - a*da)**2))
+        if residual > self.maxResidual:
+            self.stop()
+            return False
+
+        zc = mp + a*(self.center[0] + 1j*self.center[1] - ma)
+        (self.cx,self.cy) = (zc.real,zc.imag)
+        self.points = points.reshape(-1,1,2)
+        self.anchors = anchors
+        self.residual = residual
+        self.age = self.age + 1
+        self.cur = 1 - self.cur
+        return True
+
+###################################
+#
+# class cueScheduler
+#   Keep the detector within a time budget per frame under CPU load by
+#   decimating the expensive cues: at level L the Hough and corner cues run
+#   only every Nth frame (staggered) and hold their last result in between,
+#   while the cheap superwhite centroid runs on every frame.
+#
+#   The cost of each stage is tracked as a moving average of its wall time,
+#   so time lost to other processes on the CPU counts too. The level goes up
+#   as soon as the predicted cost of the current level exceeds the budget and
+#   comes back down once the lower level fits in headroom*budget for dwell
+#   frames.
+#
+# Syntax:
+#   scheduler = cueScheduler(budget,levels,headroom,alpha,dwell,parallel)
+#   detector = padDetector(...,scheduler=scheduler)
+#
+#   budget = detection time allowed per frame (s)
+#   levels = (hough,corners) decimation periods, one pair per level
+#   alpha = weight of the newest sample in the stage cost averages
+#   parallel = cues run concurrently (cuePipeline), cost is the slowest cue
+#
+# Fields:
+#   level = current decimation level (0 = every cue on every frame)
+#   costs = average wall time per stage (s)
+#   predicted = predicted cost per frame at the current level (s)
+#   frames, raises = frames scheduled, times the level was raised
+#
+#####
+
+DECIMATION = [(1,1),(2,2),(4,4),(8,8)]
+
+class cueScheduler:
+    def __init__(self,budget,levels=DECIMATION,headroom=0.7,alpha=0.1,dwell=30,
+            parallel=False):
+        self.budget = budget
+        self.levels = levels
+        self.headroom = headroom
+        self.alpha = alpha
+        self.dwell = dwell
+        self.parallel = parallel
+
+        self.level = 0
+        self.costs = {}
+        self.predicted = 0.0
+        self.frames = 0
+        self.raises = 0
+        self.calm = 0
+
+    def plan(self):
+        # cues to skip on the next frame
+        (nH,nC) = self.levels[self.level]
+        k = self.frames
+        skip = set()
+        if k % nH != 0:
+            skip.add('hough')
+        if (k + nC//2) % nC != 0:
+            skip.add('corners')
+        return skip
+
+    def predict(self,level):
+        (nH,nC) = self.levels[level]
+        c = self.costs
+        base = c.get('prep',0.0) + c.get('fusion',0.0)
+        white = c.get('superwhite',0.0) + c.get('moments',0.0)
+        hough = c.get('hough',0.0)/nH
+        corners = c.get('corners',0.0)/nC
+        if self.parallel:
+            return base + max(white,hough,corners)
+        return base + white + hough + corners
+
+    def update(self,times):
+        for (stage,dt) in times.items():
+            if stage in self.costs:
+                self.costs[stage] = self.costs[stage] + self.alpha*(dt - self.costs[stage])
+            else:
+                self.costs[stage] = dt
+        self.frames = self.frames + 1
+
+        self.predicted = self.predict(self.level)
+        if self.predicted > self.budget and self.level + 1 < len(self.levels):
+            self.level = self.level + 1                 # degrade now
+            self.raises = self.raises + 1
+            self.calm = 0
+        elif self.level > 0 and self.predict(self.level - 1) < self.headroom*self.budget:
+            self.calm = self.calm + 1
+            if self.calm >= self.dwell:                 # restore after a calm spell
+                self.level = self.level - 1
+                self.calm = 0
+        else:
+            self.calm = 0
+
+###################################
+#
+# function scaleCues
+#   Scale cue coordinates from a pyramid level up to working resolution
+#
+#####
+
+def scaleCues(det,scale):
+    offset = (scale - 1)/2.0                        # center of the coarse pixel
+    det.m00 = det.m00*scale**2
+    if det.detectGRY:
+        det.cxGRY = det.cxGRY*scale + offset
+        det.cyGRY = det.cyGRY*scale + offset
+        det.crGRY = det.crGRY*scale
+        if det.circles is not None:
+            det.circles = det.circles*scale + (offset,offset,0.0)
+    if det.detect255h:
+        det.cx255h = int(det.cx255h*scale + offset)
+        det.cy255h = int(det.cy255h*scale + offset)
+    if det.detectCRN:
+        det.corners = det.corners*scale + int(offset)
+        det.cxCRN = int(det.cxCRN*scale + offset)
+        det.cyCRN = int(det.cyCRN*scale + offset)
+    for (name,cand) in det.found.items():
+        cand = np.array(cand,dtype=np.float64).reshape(len(cand),-1)
+        cand[:,:2] = cand[:,:2]*scale + offset
+        cand[:,2] = cand[:,2]*scale
+        det.found[name] = cand
+
+###################################
+#
+# function shiftCues
+#   Translate cue coordinates from an ROI window back to the full frame
+#
+#####
+
+def shiftCues(det,x0,y0):
+    if det.detectGRY:
+        det.cxGRY = det.cxGRY + x0
+        det.cyGRY = det.cyGRY + y0
+        if det.circles is not None:
+            det.circles = det.circles + (x0,y0,0.0)
+    if det.detect255h:
+        det.cx255h = det.cx255h + x0
+        det.cy255h = det.cy255h + y0
+    if det.detectCRN:
+        det.corners = det.corners + (x0,y0)
+        det.cxCRN = det.cxCRN + x0
+        det.cyCRN = det.cyCRN + y0
+    for (name,cand) in det.found.items():
+        cand = np.array(cand,dtype=np.float64).reshape(len(cand),-1)
+        cand[:,:2] = cand[:,:2] + (x0,y0)
+        det.found[name] = cand
+
+###################################
+#
+# class cuePipeline
+#   Run the cues of a padDetector concurrently on worker threads, one per
+#   cue stage registered when the pipeline is made (see FUSION_CUES), with
+#   up to depth frames in flight
+#
+#   The workers read the same grayscale array (no copies or pickling);
+#   OpenCV releases the interpreter lock while it runs, so the cues use
+#   separate cores. A buffer pool of the detector is grown to depth+1 slots
+#   so frames in flight never share working images. With depth > 1 the ROI/proximity state used for a new
+#   frame comes from the last fused frame, depth-1 frames earlier.
+#   Optical flow tracking (padDetector flow) takes over a frame only when
+#   no frame is in flight, so only with depth 1; deeper pipelines do not
+#   seed the tracker either.
+#
+# Syntax:
+#   pipeline = cuePipeline(detector,depth)
+#   out = pipeline.process(frame,tag)   # None until the pipeline is full
+#   (tag,det) = out
+#   (tag,det) = pipeline.collect()      # drain remaining frames
+#   pipeline.stop()                     # waits for frames in flight, joins workers
+#
+#   tag = any object returned with the frame's detection (e.g. stamp, frame)
+#
+#####
+
+class cueJob:
+    def __init__(self,det,tag,times,frame=None,pending=1):
+        self.det = det
+        self.tag = tag
+        self.times = times
+        self.frame = frame
+        self.pending = pending
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+    def cueDone(self):
+        with self.lock:
+            self.pending = self.pending - 1
+            if self.pending == 0:
+                self.event.set()
+
+class cuePipeline:
+    def __init__(self,detector,depth=1):
+        self.detector = detector
+        self.depth = max(depth,1)
+        self.inflight = collections.deque()
+
+        # one set of working images per frame in flight plus the one fused
+        if detector.pool:
+            detector.allocBuffers(self.depth + 1)
+
+        self.queues = {}
+        self.workers = []
+        for (cue,(stage,_,_)) in FUSION_CUES.items():
+            if stage is None:
+                continue
+            self.queues[cue] = queue.Queue()
+            worker = threading.Thread(target=self.work,args=(cue,self.queues[cue]))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self,cue,tasks):
+        detector = self.detector
+        while True:
+            job = tasks.get()
+            if job is None:
+                break
+            if cue not in job.det.skip:
+                detector.runCue(cue,job.det,job.times)
+            job.cueDone()
+
+    def submit(self,frame,tag=None):
+        det = self.detector.begin(frame)
+        job = cueJob(det,tag,self.detector.times,frame,len(self.queues))
+        for tasks in self.queues.values():
+            tasks.put(job)
+        self.inflight.append(job)
+
+    def collect(self):
+        if not self.inflight:
+            return None
+        job = self.inflight.popleft()
+        job.event.wait()
+        self.detector.times = job.times
+        self.detector.tLap = time.time()
+        self.detector.finish(job.det)
+        if self.depth == 1:     # deeper pipelines never track, see process
+            self.detector.seed(job.frame,job.det)
+        job.frame = None
+        return job.tag, job.det
+
+    def process(self,frame,tag=None):
+        if not self.inflight:      # tracking replaces the cues on this frame
+            det = self.detector.track(frame)
+            if det is not None:
+                return tag, det
+        self.submit(frame,tag)
+        if len(self.inflight) >= self.depth:
+            return self.collect()
+        return None
+
+    def stop(self):
+        # let the frames in flight finish, then end and join the workers
+        while self.inflight:
+            self.inflight.popleft().event.wait()
+        for tasks in self.queues.values():
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+###################################
+#
+# function drawDetection
+#   Draw circles, centroids and corners of a detection on a BGR frame
+#
+#####
+
+def drawDetection(frame,det):
+    dimy, dimx = frame.shape[:2]
+
+    if det.detectGRY:
+        cv2.circle(frame,(int(det.cxGRY),int(det.cyGRY)),int(det.crGRY),(0,0,255),5)
+
+    if det.detect255h:
+        cv2.circle(frame,(det.cx255h,det.cy255h),10,(0,255,0),-1)
+    else:
+        cv2.circle(frame,(dimx//2,dimy//2),10,(0,0,0),-1)
+
+    if det.detectCRN:
+        for x,y in det.corners:
+            cv2.circle(frame,(int(x),int(y)),5,(0,255,255),-1)
+        cv2.circle(frame,(int(det.cxCRN),int(det.cyCRN)),10,(0,255,255),-1)
+
+###################################
+#
+# function frameSource
+#   Replay frames from a video file or a directory of images
+#
+# Syntax:
+#   for (name,frame) in frameSource(path,width):
+#
+#   path = video file or directory of images (sorted by file name)
+#   width = width frames are resized to, keeping aspect (None = as is)
+#   name = image file name, or frame index for video files
+#
+#####
+
+def frameSource(path,width=None):
+    if os.path.isdir(path):
+        names = sorted(f for f in os.listdir(path) if f.lower().endswith(IMG_EXT))
+        for name in names:
+            frame = cv2.imread(os.path.join(path,name))
+            if frame is None:
+                continue
+            yield name, resizeWidth(frame,width)
+    else:
+        cap = cv2.VideoCapture(path)
+        k = 0
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield str(k), resizeWidth(frame,width)
+                k = k + 1
+        finally:
+            cap.release()
+
+def resizeWidth(frame,width):
+    if width is None or frame.shape[1] == width:
+        return frame
+    height = int(frame.shape[0]*float(width)/frame.shape[1])
+    return cv2.resize(frame,(width,height),interpolation=cv2.INTER_AREA)
+
+###################################
+#
+# function readLabels
+#   Read labelled pad centers for replay benchmarking
+#
+# Syntax:
+#   labels = readLabels(path)
+#
+#   path = text file with one "name,x,y" line per frame, x,y in full
+#          resolution pixels and -1,-1 for frames without the pad;
+#          lines starting with # are ignored
+#   labels = dict name -> (x,y)
+#
+#####
+
+def readLabels(path):
+    labels = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, x, y = [v.strip() for v in line.split(',')[:3]]
+            labels[name] = (float(x),float(y))
+    return labels
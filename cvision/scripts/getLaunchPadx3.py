@@ -6,6 +6,25 @@
 # 2) Circle detection on grayscale
 # 3) Corner detection
 # Publish (x,y) of detected center of a 640x480 screen
+#
+# The flags & constants below are defaults; each can be set at run time
+# with a private parameter of the same name in lower case, e.g.
+#   rosrun cvision getLaunchPadx3.py _imgshow:=true _loop_rate:=20
+# The optional detection modes (PYRAMID, ROION, PIPELINE, BUFPOOL, ADAPTIVE,
+# FLOW, ADAPT_WHITE, CANDIDATES) are off by default; a launch file turns
+# each on with its private parameter, e.g.
+#   <node pkg="cvision" type="getLaunchPadx3.py" name="launchpad">
+#     <param name="pyramid" value="true"/>
+#     <param name="red" value="1"/>
+#   </node>
+# By default the node runs headless: it neither draws nor opens windows,
+# and publishes the cues on target_cues for viewDetections.py instead.
+# With CANDIDATES > 0 all scored pad candidates of each frame are also
+# published on target_candidates (see cvisionLib.candidatesToCloud).
+# The fusion policy and the cues that run are re-read every 1/PARAM_RATE s,
+# so they can be changed in flight, e.g.
+#   rosparam set /<node>/fusion vote
+#   rosparam set /<node>/enabled_cues "[superwhite, corners]"
 #####
 
 import rospy
@@ -13,22 +32,12 @@ import numpy as np
 import cv2
 import imutils
 
-from math import sqrt
-from geometry_msgs.msg import Point32
-from cv_bridge import CvBridge, CvBridgeError
-from sensor_msgs.msg import Image
-
-# Check version of OpenCV
-
-if cv2.__version__.startswith('2'):
-    OLDCV = True
-else:
-    OLDCV = False
-    
-if OLDCV:
-    import cv2.cv as cv
+from geometry_msgs.msg import Point32, PointStamped, PoseStamped
+from sensor_msgs.msg import CompressedImage, PointCloud
 
 import cvisionLib
+import detectorLib
+import flightLog
 
 ###################################
 
@@ -41,235 +50,321 @@ rospy.set_param('/pix2m/m2pix', 0.00104167) # 0.5m = 480pixels
 
 # Flags & Constants
 FEMASKON = True     # Use fisheye mask
-THRESH = 10000.0    # threshold for positive centroid detection
 TOL = 1.5           # radius multiplier for circle inclusion
 ERODE = False       # Use erode/dilate vs blur
-LIBERAL = True      # Allow lone bright white detection
-HOVERLOW = False    # Allow corner only detection override (for temporary testing)
-RED = 2             # Image size reduction
-DIMX = 640/RED      # Reduced x-dimension
-DIMY = 480/RED      # Reduced y-dimension
-PXRAD = DIMY/4      # Radius for PXmask
-LOOP_RATE = 15      # publishing rate (Hz)
+LIBERAL = True      # Allow lone bright white detection (chain fusion)
+HOVERLOW = False    # Allow corner only detection override (for temporary testing, chain fusion)
+FUSION = 'chain'    # Cue fusion policy: 'chain', 'vote', 'nearest' or 'priority'
+FUSION_WEIGHTS = {} # Cue weights, e.g. {'corners': 0.5}, 0 leaves a cue out (not with 'chain')
+FUSION_MIN_SCORE = 2.0  # Summed weight accepting a candidate ('vote')
+ENABLED_CUES = ['superwhite','hough','corners']     # Cues run on each frame
+PYRAMID = False     # Coarse-to-fine search on an image pyramid, level from altitude
+PYRLEVELS = 2       # Coarsest pyramid level
+PADRAD = 0.5        # Launch pad radius (m)
+RED = 2             # Image size reduction (None = 1 with PYRAMID, else 2)
+DIMX = None         # Reduced x-dimension (640/RED)
+DIMY = None         # Reduced y-dimension (480/RED)
+PXRAD = None        # Radius for PXmask (None = DIMY/4)
+THRESH = None       # threshold for positive centroid detection (None = 10000 at RED 2, scaled with area),
+                    # lowered with altitude to the expected pad size once the pose is known
+ADAPT_WHITE = False # Superwhite threshold follows the exposure (histogram of each frame)
+WHITE_MARGIN = 30   # Superwhite threshold below the level of the brightest pixels
+CENTROID = 'moments'  # Superwhite centroid: 'moments', 'projection' (row/column sums) or 'blob'
+                    # (largest blob only, m00 is then its area alone)
+CANDIDATES = 0      # Scored pad candidates published per frame on target_candidates (0 = off)
+ROION = False       # Restrict processing to a window around the last detection
+ROIMARGIN = None    # Margin around the PXRAD window (None = 20 pixels at RED 2)
+ROIMISSES = 5       # Misses before falling back to full frame search
+PIPELINE = False    # Run superwhite, Hough and corner cues on parallel threads
+PIPE_DEPTH = 1      # Frames in flight in the cue pipeline (1 = no added latency)
+BUFPOOL = False     # Preallocate working images once and reuse them every frame
+ADAPTIVE = False    # Decimate Hough/corner cues when detection exceeds its budget
+BUDGET = 0.6        # Fraction of the frame period available to detection
+FLOW = False        # Follow a confirmed pad by optical flow between full detections
+FLOW_REDETECT = 10  # Frames tracked before a full detection (sooner if the track degrades)
+LOOP_RATE = 15      # publishing rate (Hz), 30 sustainable with FLOW
+NBUF = 3            # capture ring buffer slots
+LATE_AGE = 0.1      # age of a frame counted as late (s)
+REPORT_RATE = 0.1   # capture statistics logging rate (Hz)
+PARAM_RATE = 1      # rate of re-reading the in-flight parameters (Hz)
 
 # Image showing/saving/streaming
-IMGSHOW = True      # Show images to screen
+IMGSHOW = False     # Draw cues and show images to screen (not headless)
+CUES = True         # Publish cues for remote viewers (viewDetections.py)
 IMGPUB = False      # Publish raw images
 IMGSTREAM = True    # Stream reduced images
 PUB_RATE = 3        # save rate (Hz)
 STREAM_RATE = 2     # streaming rate (Hz)
-
-# Creat fisheye mask
-FEmask = np.zeros((DIMY,DIMX,1), np.uint8)
-cv2.circle(FEmask,(DIMX/2,DIMY/2),DIMX/2,(255,255,255),-1)
-
-# Create erosion/dilation kernels
-kernelE = np.ones((3,3),np.uint8)
-kernelD = np.ones((3,3),np.uint8)
+PUB_FORMAT = 'jpeg' # raw image encoding ('jpeg' or 'png')
+PUB_QUALITY = 95    # JPEG quality (PNG: compression level 0-9)
+STREAM_FORMAT = 'jpeg'  # stream encoding
+STREAM_QUALITY = 60     # stream JPEG quality
+STREAM_WIDTH = 200      # stream image width (pixels)
+
+PARAMS = ['FEMASKON','TOL','ERODE','LIBERAL','HOVERLOW','FUSION','FUSION_WEIGHTS',
+    'FUSION_MIN_SCORE','ENABLED_CUES','PYRAMID','PYRLEVELS','PADRAD','RED','PXRAD',
+    'THRESH','ADAPT_WHITE','WHITE_MARGIN','CENTROID','CANDIDATES','ROION',
+    'ROIMARGIN','ROIMISSES','PIPELINE','PIPE_DEPTH','BUFPOOL','ADAPTIVE','BUDGET',
+    'FLOW','FLOW_REDETECT','LOOP_RATE','NBUF','LATE_AGE','REPORT_RATE','PARAM_RATE',
+    'IMGSHOW','CUES','IMGPUB','IMGSTREAM','PUB_RATE','STREAM_RATE','PUB_FORMAT',
+    'PUB_QUALITY','STREAM_FORMAT','STREAM_QUALITY','STREAM_WIDTH']
+
+# Parameters re-read in flight (see reconfigure)
+RUNTIME_PARAMS = ['FUSION','FUSION_WEIGHTS','FUSION_MIN_SCORE','ENABLED_CUES']
+
+# Telemetry recorded every frame
+STAGES = ['prep','superwhite','hough','moments','corners','fusion','flow']
+LOG_FIELDS = ['t','latency','detect','detectGRY','detect255h','detectCRN','tracked',
+    'cx','cy','xSp','ySp','m00','white','mThresh','roi','dropped','late','level','pyrLevel'] + ['t_' + stage for stage in STAGES]
 
 # Create publishers
 targetPixel = rospy.Publisher('target_xyPixel', Point32, queue_size=10)
 targetSp = rospy.Publisher('target_xySp', Point32, queue_size=10)
+targetSpStamped = rospy.Publisher('target_xySpStamped', PointStamped, queue_size=10)
 
-img_pub	 = 	rospy.Publisher('image_feed', Image, queue_size=10)
-raw_img_pub = 	rospy.Publisher('raw_img', Image, queue_size=10)
+img_pub	 = 	rospy.Publisher('image_feed/compressed', CompressedImage, queue_size=1)
+raw_img_pub = 	rospy.Publisher('raw_img/compressed', CompressedImage, queue_size=1)
+targetCues = rospy.Publisher('target_cues', PointCloud, queue_size=1)
+targetCandidates = rospy.Publisher('target_candidates', PointCloud, queue_size=10)
 msgPixel = Point32()
 msgSp = Point32()
-bridge = CvBridge()
-
-spGen = cvisionLib.pix2m() # setpoint generator
+msgSpStamped = PointStamped()
+
+# Detector, setpoint generator and encoders (built by setup())
+spGen = None
+scheduler = None
+fusion = None
+detector = None
+pipeline = None
+streamer = None
+recorder = None
+
+def configure():
+    # override flags & constants with private parameters and derive the rest
+    global RED, DIMX, DIMY, PXRAD, THRESH, ROIMARGIN
+    config = globals()
+    for name in PARAMS:
+        config[name] = rospy.get_param('~' + name.lower(), config[name])
+
+    if RED is None:
+        RED = 1 if PYRAMID else 2
+    DIMX = 640//RED
+    DIMY = 480//RED
+    if PXRAD is None:
+        PXRAD = DIMY//4
+    if THRESH is None:
+        THRESH = 10000.0*(2.0/RED)**2   # m00 scales with area
+    if ROIMARGIN is None:
+        ROIMARGIN = 40//RED
+
+def setup():
+    global spGen, scheduler, fusion, detector, pipeline, streamer, recorder
+
+    spGen = cvisionLib.pix2m() # setpoint generator
+    if ADAPTIVE:
+        scheduler = detectorLib.cueScheduler(BUDGET/LOOP_RATE,parallel=PIPELINE)
+    fusion = detectorLib.cueFusion(FUSION,TOL,PXRAD,FUSION_WEIGHTS,FUSION_MIN_SCORE,
+        liberal=LIBERAL,hoverLow=HOVERLOW)
+    detector = detectorLib.padDetector(DIMX,DIMY,femaskOn=FEMASKON,thresh=THRESH,
+        tol=TOL,erode=ERODE,liberal=LIBERAL,hoverLow=HOVERLOW,pxRad=PXRAD,
+        roiOn=ROION,roiMargin=ROIMARGIN,roiMisses=ROIMISSES,buffers=int(BUFPOOL),
+        scheduler=scheduler,pyramid=PYRAMID,pyrLevels=PYRLEVELS,
+        padRadius=PADRAD*rospy.get_param('/pix2m/altCal')/rospy.get_param('/pix2m/m2pix')/RED,
+        flow=detectorLib.flowTracker(DIMX,DIMY,FLOW_REDETECT) if FLOW else None,
+        adaptWhite=ADAPT_WHITE,whiteMargin=WHITE_MARGIN,centroid=CENTROID,
+        candidates=CANDIDATES,fusion=fusion)
+    detector.setCues(ENABLED_CUES)
+    if PIPELINE:
+        pipeline = detectorLib.cuePipeline(detector,PIPE_DEPTH)
+
+    # Encoders publishing on background threads
+    streamer = cvisionLib.imageStreamer(img_pub,STREAM_RATE,STREAM_FORMAT,STREAM_QUALITY,
+        STREAM_WIDTH,gray=True,clock=rospy.get_time)
+    recorder = cvisionLib.imageStreamer(raw_img_pub,PUB_RATE,PUB_FORMAT,PUB_QUALITY,
+        clock=rospy.get_time)
+
+def isNumber(value):
+    return isinstance(value,(int,float)) and not isinstance(value,bool)
+
+def validParam(name,value):
+    # True if the detector accepts value for a runtime parameter
+    if name == 'FUSION':
+        return value in detectorLib.FUSION_POLICIES
+    if name == 'FUSION_WEIGHTS':
+        return isinstance(value,dict) and all(cue in detectorLib.FUSION_CUES and
+            isNumber(weight) and weight >= 0 for (cue,weight) in value.items())
+    if name == 'FUSION_MIN_SCORE':
+        return isNumber(value)
+    if name == 'ENABLED_CUES':
+        return isinstance(value,list) and all(cue in detectorLib.FUSION_CUES for cue in value)
+    return True
+
+def reconfigure():
+    # apply fusion and cue changes made with rosparam while running; an
+    # invalid value is not applied and checked again on the next call
+    config = globals()
+    changed = []
+    for name in RUNTIME_PARAMS:
+        value = rospy.get_param('~' + name.lower(), config[name])
+        if value == config[name]:
+            continue
+        if not validParam(name,value):
+            rospy.logwarn('%s not changed: invalid value %s', name.lower(), value)
+            continue
+        config[name] = value
+        changed.append(name)
+    if not changed:
+        return
+    if 'FUSION' in changed:
+        fusion.configure(policy=FUSION)
+    if 'FUSION_WEIGHTS' in changed:
+        fusion.configure(weights=FUSION_WEIGHTS)
+    if 'FUSION_MIN_SCORE' in changed:
+        fusion.configure(minScore=FUSION_MIN_SCORE)
+    if 'ENABLED_CUES' in changed:
+        detector.setCues(ENABLED_CUES)
+    rospy.loginfo('fusion %s weights %s, cues %s', fusion.policy, fusion.weights,
+        ','.join(ENABLED_CUES))
+
+# Altitude above the first pose received, for the pyramid level and m00 threshold
+zGround = None
+
+def cbPos(msg):
+    global zGround
+    if not msg == None:
+        if zGround is None:
+            zGround = msg.pose.position.z
+        detector.setAltitude(msg.pose.position.z - zGround)
 
 def getLaunchPadCircles():
 
     # initialize node & set rate in Hz
 
     rospy.init_node('tracker', anonymous=True)
+    configure()
+    setup()
     rate = rospy.Rate(LOOP_RATE)
+    rospy.Subscriber('/mavros/local_position/pose', PoseStamped, cbPos)
 
-    # Initializations
-
-    cxHold = -1.0
-    cyHold = -1.0
-    Detect = False
-    DetectHold = False
-    PXMASKON = False
-    kc = 0              # number of iterations
-    img_k = 1000		# counter of saved images
-
-    # start video stream
+    # start video stream on a dedicated capture thread
     cap = cv2.VideoCapture(0)
+    grabber = cvisionLib.frameGrabber(cap,NBUF,LATE_AGE,rospy.get_time)
+    grabber.start()
+    if IMGSTREAM:
+        streamer.start()
+    if IMGPUB:
+        recorder.start()
 
-    while not rospy.is_shutdown():
-
-        # grab and resize frame
-        _, frame = cap.read()
-        frame = imutils.resize(frame, width=DIMX)
-        raw_frame=frame.copy()
-
-        # convert to grayscale
-        frameGRY = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # apply fisheye mask
-        if FEMASKON:
-            frameGRY = cv2.bitwise_and(frameGRY,FEmask)
-        
-        # apply proximity mask
-        if PXMASKON:
-            frameGRY = cv2.bitwise_and(frameGRY,PXmask)
-
-        # extract superwhite
-        _, mask255h = cv2.threshold(frameGRY,225,255,cv2.THRESH_BINARY)
-
-        # filter superwhite using either erode/dilate or blur
-        if ERODE:
-            mask255h = cv2.erode(mask255h,kernelE,iterations = 1)
-            mask255h = cv2.dilate(mask255h,kernelD,iterations = 1)
-        else:
-            mask255h = cv2.blur(mask255h, (3,3))
-            _, mask255h =  cv2.threshold(mask255h,245,255,cv2.THRESH_BINARY)
+    # start telemetry recorder
+    flog = flightLog.flightLog(flightLog.logPath('tracker'),LOG_FIELDS)
 
-        # extract circles from grayscale
-
-        if OLDCV:
-            circlesGRY = cv2.HoughCircles(frameGRY,cv.CV_HOUGH_GRADIENT,1,DIMY,
-                param1=50,param2=80,minRadius=DIMY/50,maxRadius=DIMY/4)
-        else:
-            circlesGRY = cv2.HoughCircles(frameGRY,cv2.HOUGH_GRADIENT,1,DIMY,
-                param1=50,param2=80,minRadius=DIMY/50,maxRadius=DIMY/4)
-
-        # assess circles 
-
-        if circlesGRY is not None:
-            temp = circlesGRY[0,0]
-            cxGRY = temp[0]
-            cyGRY = temp[1]
-            crGRY = temp[2]
-            detect_GRY = True
-            cv2.circle(frame,(cxGRY,cyGRY),crGRY,(0,0,255),5)
-        else:
-            detect_GRY = False
+    try:
+        detectLoop(grabber,rate,flog)
+    finally:
+        flog.close()
+        if pipeline is not None:
+            pipeline.stop()
+        streamer.stop()
+        recorder.stop()
+        grabber.stop()
+        cap.release()
+        if IMGSHOW:
+            cv2.destroyAllWindows()
 
-        # Compute superwhite centroids
-        M255h = cv2.moments(mask255h)
-
-        if M255h['m00'] > THRESH:
-            cx255h = int(M255h['m10']/M255h['m00'])
-            cy255h = int(M255h['m01']/M255h['m00'])
-            cv2.circle(frame,(cx255h,cy255h),10,(0,255,0),-1)
-            detect_255h = True
-        else:
-            detect_255h = False
-            cv2.circle(frame,(DIMX/2,DIMY/2),10,(0,0,0),-1)
+def detectLoop(grabber,rate,flog):
 
+    # Initializations
 
-        # compute corners from grayscale
-        corners = cv2.goodFeaturesToTrack(frameGRY,10,0.5,20)
-        if corners is not None:
-            corners = np.int0(corners)
-            for i in corners:
-                x,y = i.ravel()
-                cv2.circle(frame,(x,y),5,(0,255,255),-1)
+    kc = 0              # number of iterations
 
-            temp = cv2.mean(corners)
-            temp = np.int0(temp)
-            cv2.circle(frame,(temp[0],temp[1]),10,(0,255,255),-1)
+    # reduced frames, one per frame in flight plus the one being drawn on
+    nFrames = 1
+    if pipeline is not None:
+        nFrames = PIPE_DEPTH + 1
+    frames = [np.zeros((DIMY,DIMX,3), np.uint8) for _ in range(nFrames)]
+    slot = 0
 
-            cxCRN = temp[0]
-            cyCRN = temp[1]
+    while not rospy.is_shutdown():
 
-            detect_CRN = True
+        # grab newest frame and resize
+        ok, frame, stamp, _ = grabber.read(1.0)
+        if not ok:
+            rospy.logwarn('no camera frame received')
+            continue
+        if BUFPOOL:
+            frame = cv2.resize(frame,(DIMX,DIMY),dst=frames[slot],
+                interpolation=cv2.INTER_AREA)
+            slot = (slot + 1) % nFrames
+        else:
+            frame = imutils.resize(frame, width=DIMX)
+
+        # record the undrawn frame (copied only when due)
+        if IMGPUB:
+            recorder.offer(frame,stamp)
+
+        # run detection stages
+        if pipeline is not None:
+            out = pipeline.process(frame,(stamp,frame))
+            if out is None:     # pipeline still filling
+                continue
+            ((stamp,frame),det) = out
         else:
-            detect_CRN = False
-
-
-        # detection acceptance logic
-        Detect = False
-        Skip = False
-        PXMASKON = False
-        CX = -1
-        CY = -1
-
-        if detect_GRY and detect_255h: # Greyscale circle + Superwhite centroid
-            error = (cxGRY - cx255h)**2 + (cyGRY - cy255h)**2
-            if sqrt(error) < TOL*crGRY:
-                Detect = True
-                CX = cxGRY
-                CY = cyGRY
-                Skip = True
-        
-        if detect_GRY and detect_CRN and not Skip: # Greyscale circle + Corners
-            error = (cxGRY - cxCRN)**2 + (cyGRY - cyCRN)**2
-            if sqrt(error) < TOL*crGRY:
-                Detect = True
-                CX = cxGRY
-                CY = cyGRY
-                Skip = True                
-
-        if detect_255h and detect_CRN and not Skip: # Superwhite centroid + Corners
-            error = (cx255h - cxCRN)**2 + (cy255h - cyCRN)**2
-            if sqrt(error) < PXRAD/2:
-                Detect = True
-                CX = cx255h
-                CY = cy255h
-                Skip = True
-
-        if LIBERAL:
-            if detect_255h and not detect_GRY and not detect_CRN and not Skip:
-                Detect = True
-                CX = cx255h
-                CY = cy255h
-
-        if HOVERLOW:
-            if detect_CRN:
-                Detect = True
-                CX = cxCRN
-                CY = cyCRN
-
-        # Create proximity mask for next image
-        if Detect and DetectHold: # create a proximity mask of PXRAD radius circle
-                PXmask = np.zeros((DIMY,DIMX,1), np.uint8)
-                cv2.circle(PXmask,(CX,CY),PXRAD,(255,255,255),-1)
-                PXMASKON = True
-
-        # save for next iteration
-        cxHold = CX
-        cyHold = CY
-        DetectHold = Detect
+            det = detector.detect(frame)
 
         # publish location with reduction correction
-        msgPixel.x = CX*RED
-        msgPixel.y = CY*RED
+        msgPixel.x = det.cx*RED
+        msgPixel.y = det.cy*RED
         msgPixel.z = 0.0 # Not used
         (msgSp.x, msgSp.y, msgSp.z) = spGen.targetFishEye(msgPixel)
 
-        rate.sleep()
         targetPixel.publish(msgPixel)
         targetSp.publish(msgSp)
-
-        # show/save/stream images
+        msgSpStamped.header.stamp = rospy.Time.from_sec(stamp)    # capture time
+        (msgSpStamped.point.x, msgSpStamped.point.y, msgSpStamped.point.z) = (msgSp.x, msgSp.y, msgSp.z)
+        targetSpStamped.publish(msgSpStamped)
+        grabber.published(stamp)
+        if CANDIDATES > 0:
+            targetCandidates.publish(cvisionLib.candidatesToCloud(det,stamp,spGen,RED))
+        if CUES:
+            targetCues.publish(cvisionLib.cuesToCloud(det,stamp,RED))
+
+        flog.record(stamp,grabber.latency,det.detect,det.detectGRY,det.detect255h,
+            det.detectCRN,det.tracked,det.cx,det.cy,msgSp.x,msgSp.y,det.m00,
+            detector.white,detector.mThresh,det.roi != (0,0,DIMX,DIMY),
+            grabber.dropped,grabber.late,
+            scheduler.level if scheduler is not None else 0,detector.pyrLevel,
+            *[detector.times.get(stage,0.0) for stage in STAGES])
+
+        if (kc*PARAM_RATE)%LOOP_RATE < PARAM_RATE:
+            reconfigure()
+
+        if (kc*REPORT_RATE)%LOOP_RATE < REPORT_RATE:
+            rospy.loginfo('capture: %s', grabber.report())
+            if IMGSTREAM:
+                rospy.loginfo('stream: %s', streamer.report())
+            if IMGPUB:
+                rospy.loginfo('raw images: %s', recorder.report())
+            if scheduler is not None and scheduler.level > 0:
+                rospy.loginfo('detector load level %d: predicted %.1f ms of %.1f ms budget',
+                    scheduler.level,1000.0*scheduler.predicted,1000.0*scheduler.budget)
+
+        # show/stream images (drawing only when shown on screen)
         if IMGSHOW:
+            detectorLib.drawDetection(frame,det)
             cv2.imshow('color',frame)
-            cv2.imshow('gray',frameGRY)
-            cv2.imshow('high',mask255h)
+            cv2.imshow('gray',det.gray)
+            if det.mask is not None:    # no mask on tracked frames
+                cv2.imshow('high',det.mask)
             key = cv2.waitKey(1) & 0xFF
 
-        if IMGPUB: # publish raw image
-            if (kc*SAVE_RATE)%LOOP_RATE < SAVE_RATE:
-                raw_img_pub.publish(bridge.cv2_to_imgmsg(raw_frame, encoding="bgr8"))
-                img_k = img_k+1
-
         if IMGSTREAM: # stream processed image
-            if (kc*STREAM_RATE)%LOOP_RATE < STREAM_RATE:
-                gray_frame=cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                gray_frame=imutils.resize(gray_frame, width=200)
-                img_pub.publish(bridge.cv2_to_imgmsg(gray_frame, encoding="passthrough"))
+            streamer.offer(frame,stamp)
 
         kc = kc + 1
+        rate.sleep()
 
 if __name__ == '__main__':
     try:
         getLaunchPadCircles()
     except rospy.ROSInterruptException:
-        cap.release()
-        cv2.destroyAllWindows()
         pass
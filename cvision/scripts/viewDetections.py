@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+#####
+# Render the launch pad detections of a headless tracker node
+#
+# Subscribes to the compressed debug stream and the published cues, draws
+# the cues on the frame captured at the same time and shows it. Runs on
+# any machine on the ROS network, so the tracker never draws or opens
+# windows itself.
+#
+# Usage:
+#   rosrun cvision viewDetections.py [_image:=image_feed/compressed] [_rate:=10]
+#####
+
+import collections
+import threading
+
+import rospy
+import numpy as np
+import cv2
+
+from sensor_msgs.msg import CompressedImage, PointCloud
+
+import cvisionLib
+import detectorLib
+
+###################################
+#
+# class detectionViewer
+#   Pair stream frames with cues by capture stamp and draw them
+#
+# Subscriptions:
+#   rospy.Subscriber(image, CompressedImage, self.cbImage)
+#   rospy.Subscriber('target_cues', PointCloud, self.cbCues)
+#
+#####
+
+class detectionViewer:
+    def __init__(self,lx,keep=30):
+        self.lx = lx
+        self.cues = collections.OrderedDict()       # stamp -> PointCloud
+        self.keep = keep
+        self.image = None
+        self.lock = threading.Lock()
+
+    def cbCues(self,msg):
+        if not msg == None:
+            with self.lock:
+                self.cues[msg.header.stamp.to_sec()] = msg
+                while len(self.cues) > self.keep:
+                    self.cues.popitem(last=False)
+
+    def cbImage(self,msg):
+        if not msg == None:
+            with self.lock:
+                self.image = msg
+
+    def render(self):
+        with self.lock:
+            msg = self.image
+            self.image = None
+            if msg is None:
+                return None
+            cues = self.cues.get(msg.header.stamp.to_sec())
+
+        frame = cv2.imdecode(np.frombuffer(msg.data,np.uint8),cv2.IMREAD_COLOR)
+        if frame is None:
+            return None
+        if cues is not None:
+            det = cvisionLib.cloudToCues(cues,frame.shape[1]/self.lx)
+            detectorLib.drawDetection(frame,det)
+            if det.detect:
+                cv2.circle(frame,(int(det.cx),int(det.cy)),6,(255,0,0),2)
+        return frame
+
+def viewDetections():
+    rospy.init_node('detection_viewer', anonymous=True)
+    rate = rospy.Rate(rospy.get_param('~rate',10.0))
+
+    viewer = detectionViewer(rospy.get_param('/pix2m/LX',640.0))
+    rospy.Subscriber('target_cues', PointCloud, viewer.cbCues)
+    rospy.Subscriber(rospy.get_param('~image','image_feed/compressed'), CompressedImage,
+        viewer.cbImage, queue_size=1)
+
+    try:
+        while not rospy.is_shutdown():
+            frame = viewer.render()
+            if frame is not None:
+                cv2.imshow('detections',frame)
+            cv2.waitKey(1)
+            rate.sleep()
+    finally:
+        cv2.destroyAllWindows()
+
+if __name__ == '__main__':
+    try:
+        viewDetections()
+    except rospy.ROSInterruptException:
+        pass